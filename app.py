@@ -1,23 +1,144 @@
 import os
 import tempfile
 import shutil
+import stat
+import sys
 import json
 import re
+import csv
+import codecs
+import datetime
+import hashlib
+import importlib
+import importlib.util
 import logging
-import pandas as pd
-from flask import Flask, request, render_template, send_file, redirect, url_for, flash
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
+import multiprocessing
+import multiprocessing.util
+import pickle
+import threading
+import time
+import uuid
+import zipfile
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+from contextlib import contextmanager
+from array import array
+from calendar import monthrange
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque, namedtuple
+from functools import lru_cache, partial
+from itertools import chain, repeat
+from operator import itemgetter
+from flask import Flask, Request, g, request, render_template, send_file, redirect, url_for, flash, jsonify, abort
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+class LazyModule:
+    """
+    Stands in for a heavy module until one of its attributes is first used, then
+    imports it and replaces itself in this module's globals (so later lookups cost
+    nothing). The web process only serves pages, status and downloads; the
+    pandas/numpy/openpyxl stack (most of the import time) is loaded where the
+    parsing and writing happen, i.e. in the job pool processes.
+    """
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+np = LazyModule("numpy", "np")
+pd = LazyModule("pandas", "pd")
+openpyxl = LazyModule("openpyxl", "openpyxl")
+PROCESSING_MODULES = ("numpy", "pandas", "openpyxl")
 
 app = Flask(__name__)
 app.secret_key = "secret-key"
+# "openpyxl" streams rows straight from the workbook; "pandas" is the original
+# read_excel path, kept for comparison.
+app.config["INGEST_ENGINE"] = os.environ.get("INGEST_ENGINE", "openpyxl")
+# "python" runs process_employee_entries per employee; "vectorized" computes every
+# employee at once. Can be overridden per request with the calc_engine form field.
+app.config["CALC_ENGINE"] = os.environ.get("CALC_ENGINE", "python")
+# Uploads are processed in a pool of JOB_WORKERS processes; each web process accepts
+# at most JOB_QUEUE_DEPTH queued or running jobs before answering "busy".
+app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", "2"))
+app.config["JOB_QUEUE_DEPTH"] = int(os.environ.get("JOB_QUEUE_DEPTH", "8"))
+app.config["JOB_START_METHOD"] = os.environ.get("JOB_START_METHOD", "spawn")
+# A job process is replaced by a fresh one after JOB_MAX_TASKS jobs, which bounds
+# the memory pandas/openpyxl build up in it (0 keeps them; ignored with "fork").
+# A replaced process can only exit once its own parse pool (PARSE_WORKERS > 1) is
+# shut down, see get_parse_executor; benchmarks/check_pools.py runs that combination.
+app.config["JOB_MAX_TASKS"] = int(os.environ.get("JOB_MAX_TASKS", "50"))
+# Job pool processes import the processing stack as they start; with JOB_PREWARM a
+# gunicorn worker starts them right after booting instead of on the first upload.
+app.config["JOB_PREWARM"] = os.environ.get("JOB_PREWARM", "1").lower() in ("1", "true", "yes")
+# Sheets are parsed in a pool of PARSE_WORKERS processes (per job worker) when
+# greater than 1; the default parses them one after another.
+app.config["PARSE_WORKERS"] = int(os.environ.get("PARSE_WORKERS", "1"))
+# The files of a batch (/batch or cli.py) are calculated in a pool of BATCH_WORKERS
+# processes when greater than 1.
+app.config["BATCH_WORKERS"] = int(os.environ.get("BATCH_WORKERS", "2"))
+# Parsed records, precomputed results and result workbooks are cached on disk by the
+# SHA-256 of the upload (also the upload ID /recompute takes); least recently used
+# entries are evicted above CACHE_MAX_BYTES (0 disables). CACHE_DIR is created with
+# mode 0700; the cache is bypassed if others can write to it (see cache_dir).
+app.config["CACHE_DIR"] = os.environ.get("CACHE_DIR", os.path.join(tempfile.gettempdir(), "tato_cache"))
+app.config["CACHE_MAX_BYTES"] = int(os.environ.get("CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Requests larger than MAX_UPLOAD_BYTES are refused with 413. Uploads up to
+# UPLOAD_SPOOL_BYTES are buffered in memory, larger ones spool to JOB_DIR, where
+# every job also gets its directory. A batch ZIP may unpack to at most
+# BATCH_MAX_EXTRACTED_BYTES.
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+app.config["UPLOAD_SPOOL_BYTES"] = int(os.environ.get("UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+app.config["JOB_DIR"] = os.environ.get("JOB_DIR", os.path.join(tempfile.gettempdir(), "tato_jobs"))
+app.config["BATCH_MAX_EXTRACTED_BYTES"] = int(os.environ.get("BATCH_MAX_EXTRACTED_BYTES", str(512 * 1024 * 1024)))
+# Job directories whose result isn't downloaded within RESULT_TTL seconds are
+# removed by a janitor thread that runs every JANITOR_INTERVAL seconds (0 disables it).
+app.config["RESULT_TTL"] = int(os.environ.get("RESULT_TTL", "3600"))
+app.config["JANITOR_INTERVAL"] = int(os.environ.get("JANITOR_INTERVAL", "300"))
+# Adds a Server-Timing header with the stage durations to /process and finished
+# /jobs/<id> responses, so they show up in the browser's network panel.
+app.config["SERVER_TIMING"] = os.environ.get("SERVER_TIMING", "").lower() in ("1", "true", "yes")
+# With METRICS_SHARED (gunicorn.conf.py turns it on), every web process keeps its
+# metrics in <JOB_DIR>/metrics/<pid>.json and /metrics and /cache/stats add all of
+# them up; otherwise they only cover the process that answers.
+app.config["METRICS_SHARED"] = os.environ.get("METRICS_SHARED", "").lower() in ("1", "true", "yes")
+
+INGEST_ENGINES = ("openpyxl", "pandas")
+# Code, name and label columns followed by 31 day columns.
+MIN_ROW_WIDTH = 3 + 31
+# Plain-text exports are read with the csv module whatever the ingest engine:
+# extension -> delimiter. CSV files are sniffed for "," or ";" first.
+DELIMITED_EXTENSIONS = {".csv": ",", ".tsv": "\t"}
+# How much of a CSV file is used to detect its encoding and dialect.
+CSV_SAMPLE_BYTES = 64 * 1024
 
-# Configure logging to output to the console
+# Configure logging to output to the console. The per-day calculation breakdown is
+# not logged; request it with the trace form field instead.
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+class RequestLogger(logging.LoggerAdapter):
+    """
+    Prefixes messages with the ID of the request or job they belong to, so the
+    interleaved lines of concurrent requests (gthread workers) can be told apart.
+    """
+    def process(self, msg, kwargs):
+        return f"[{self.extra['request_id']}] {msg}", kwargs
+
+def job_logger(job_dir):
+    """Logger for a job, tagged with its job ID."""
+    return RequestLogger(app.logger, {"request_id": os.path.basename(job_dir)})
+
 # ---------- STEP 1: Read All Sheets ----------
 
 def read_all_sheets(file_path):
@@ -34,6 +155,128 @@ def read_all_sheets(file_path):
     )
     return df_dict
 
+def cell_to_str(value):
+    """
+    Converts a raw openpyxl cell value to the string read_all_sheets would produce
+    for it (dtype=str), so both ingestion paths feed the parser the same values.
+    Empty cells become None.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def iter_workbook_rows(file_path):
+    """
+    Lazily yields (sheet_name, rows) for every sheet using openpyxl's read-only,
+    values-only row iterator. `rows` is a generator of lists of strings (None for
+    empty cells), padded to MIN_ROW_WIDTH. No DataFrame is ever built, so only the
+    rows the parser keeps stay in memory.
+    """
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        for ws in wb.worksheets:
+            # Dimension tags written by other tools are often wrong, ignore them.
+            ws.reset_dimensions()
+            yield ws.title, _iter_sheet_rows(ws)
+    finally:
+        wb.close()
+
+def _iter_sheet_rows(ws):
+    for values in ws.iter_rows(values_only=True):
+        row = [cell_to_str(value) for value in values]
+        if len(row) < MIN_ROW_WIDTH:
+            row.extend([None] * (MIN_ROW_WIDTH - len(row)))
+        yield row
+
+def is_delimited(file_path):
+    """True for CSV/TSV uploads, judged by the file extension."""
+    return os.path.splitext(file_path)[1].lower() in DELIMITED_EXTENSIONS
+
+def detect_encoding(sample):
+    """
+    "utf-8-sig" if the sample is valid UTF-8 (with or without a BOM), otherwise
+    "cp1251", the encoding Excel uses for Cyrillic CSV exports on Windows.
+    """
+    try:
+        # Not final: the sample may end in the middle of a character.
+        codecs.getincrementaldecoder("utf-8-sig")().decode(sample, final=False)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "cp1251"
+
+def csv_cell_to_str(value):
+    """
+    Converts a CSV field to the string cell_to_str produces for the same workbook
+    cell: empty fields become None and decimal commas (e.g. "12,5" from a
+    Macedonian-locale export) become points.
+    """
+    if value == "":
+        return None
+    if "," in value and re.fullmatch(r"-?\d+,\d+", value.strip()):
+        return value.strip().replace(",", ".")
+    return value
+
+def iter_delimited_rows(file_path):
+    """
+    Yields a single (sheet_name, rows) for a CSV/TSV export, named after the file.
+    Rows are streamed with the csv module, converted like workbook rows and padded
+    to MIN_ROW_WIDTH, so the same employee row detection applies.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    with open(file_path, "rb") as f:
+        sample = f.read(CSV_SAMPLE_BYTES)
+    encoding = detect_encoding(sample)
+    delimiter = DELIMITED_EXTENSIONS[extension]
+    dialect = csv.excel
+    if extension == ".csv":
+        text = sample.decode(encoding, errors="ignore")
+        try:
+            dialect = csv.Sniffer().sniff(text, delimiters=",;\t")
+            delimiter = dialect.delimiter
+        except csv.Error:
+            # The sniffer gives up on ragged rows; fall back to the most common candidate.
+            delimiter = max(",;\t", key=text.count)
+    sheet_name = os.path.splitext(os.path.basename(file_path))[0]
+    with open(file_path, encoding=encoding, errors="replace", newline="") as f:
+        yield sheet_name, _iter_delimited_rows(csv.reader(f, dialect, delimiter=delimiter))
+
+def _iter_delimited_rows(reader):
+    for values in reader:
+        row = [csv_cell_to_str(value) for value in values]
+        if len(row) < MIN_ROW_WIDTH:
+            row.extend([None] * (MIN_ROW_WIDTH - len(row)))
+        yield row
+
+def iter_sheets(file_path, engine=None):
+    """
+    Yields (sheet_name, rows) for every sheet using the selected ingestion engine
+    (defaults to INGEST_ENGINE). CSV/TSV files are always streamed with the csv
+    module. Rows must be consumed before the next sheet is requested.
+    """
+    if is_delimited(file_path):
+        yield from iter_delimited_rows(file_path)
+        return
+    engine = engine or app.config["INGEST_ENGINE"]
+    if engine == "openpyxl":
+        yield from iter_workbook_rows(file_path)
+    elif engine == "pandas":
+        for sheet_name, df in read_all_sheets(file_path).items():
+            yield sheet_name, df.values.tolist()
+    else:
+        raise ValueError(f"Unknown ingest engine '{engine}', expected one of {INGEST_ENGINES}")
+
+def keep_leading_rows(rows, kept, count=6):
+    """
+    Passes rows through unchanged while copying the first `count` of them into `kept`.
+    Used to hold on to the calendar header rows of a streamed sheet.
+    """
+    for row in rows:
+        if len(kept) < count:
+            kept.append(row)
+        yield row
+
 # ---------- Helper Functions for each sheet ----------
 
 def is_hours_row(row):
@@ -43,6 +286,36 @@ def is_hours_row(row):
             return True
     return False
 
+# Row classes for employee row detection: a shift row ("смени" in the label column),
+# an hours row ("р.час") or anything else (calendar header, notes, totals).
+ROW_OTHER = 0
+ROW_SHIFT = 1
+ROW_HOURS = 2
+LABEL_COLUMN = 2
+
+def classify_label(label):
+    """Class of a row judged by its label column alone."""
+    if isinstance(label, str):
+        label = label.strip().lower()
+        if label == "смени":
+            return ROW_SHIFT
+        if "р.час" in label:
+            return ROW_HOURS
+    return ROW_OTHER
+
+def classify_frame(df):
+    """
+    Row class of every row of a sheet DataFrame as an array. The label column is
+    factorized in one vectorized pass, so classify_label only runs once per
+    distinct label (a handful per sheet) instead of once per row.
+    """
+    if df.shape[1] <= LABEL_COLUMN:
+        return np.full(len(df), ROW_OTHER)
+    codes, labels = pd.factorize(df.iloc[:, LABEL_COLUMN])
+    # Missing labels get code -1, which picks the trailing ROW_OTHER.
+    label_classes = np.array([classify_label(label) for label in labels] + [ROW_OTHER])
+    return label_classes[codes]
+
 def convert_shift_value(val):
     """
     Converts a cell value if it was misinterpreted.
@@ -65,44 +338,40 @@ def convert_shift_value(val):
             return "2/3"
     return val_str
 
-def extract_employee_rows(df):
+def employee_code(first_cell):
+    """The employee code in the first cell of a shift row, or None if it isn't a number."""
+    if first_cell is None:
+        return None
+    first_cell_str = str(first_cell)
+    if first_cell_str.endswith(".0"):
+        first_cell_str = first_cell_str[:-2]
+    return first_cell_str if first_cell_str.isdigit() else None
+
+def extract_employee_rows(rows):
     """
     Identifies and pairs:
       - A row where column 2 equals 'смени'
       - The immediately following row that contains 'р.час'
+    `rows` is any iterable of row lists and is consumed in a single pass.
     Returns a list of dicts: { code, name, shift_row, hours_row }.
     """
-    rows = df.values.tolist()
+    rows = iter(rows)
     employees = []
-    i = 0
     unknown_counter = 1
-    while i < len(rows):
-        row = rows[i]
-        if len(row) >= 3 and row[2] is not None and isinstance(row[2], str) and row[2].strip().lower() == "смени":
-            first_cell = row[0]
-            if first_cell is not None:
-                first_cell_str = str(first_cell)
-                if first_cell_str.endswith(".0"):
-                    first_cell_str = first_cell_str[:-2]
-            else:
-                first_cell_str = ""
-            if first_cell_str.isdigit():
-                emp_code = first_cell_str
-            else:
+    row = next(rows, None)
+    while row is not None:
+        if len(row) > LABEL_COLUMN and classify_label(row[LABEL_COLUMN]) == ROW_SHIFT:
+            emp_code = employee_code(row[0])
+            if emp_code is None:
                 emp_code = f"unknown_{unknown_counter}"
                 unknown_counter += 1
             emp_name = row[1] if row[1] is not None else ""
             shift_row = row
             hours_row = None
-            if i + 1 < len(rows):
-                next_row = rows[i + 1]
-                if is_hours_row(next_row):
-                    hours_row = next_row
-                    i += 2
-                else:
-                    i += 1
-            else:
-                i += 1
+            row = next(rows, None)
+            if row is not None and is_hours_row(row):
+                hours_row = row
+                row = next(rows, None)
             employees.append({
                 "code": emp_code,
                 "name": emp_name,
@@ -110,70 +379,312 @@ def extract_employee_rows(df):
                 "hours_row": hours_row
             })
         else:
-            i += 1
+            row = next(rows, None)
     return employees
 
-def parse_days_into_dicts(df, employees):
+def extract_frame_employee_rows(df):
+    """
+    extract_employee_rows for a sheet DataFrame, driven by the classify_frame index:
+    only the shift rows are visited, each paired with the next row if that is an
+    hours row (judged by its label, or by scanning its cells like is_hours_row).
+    """
+    rows = df.values.tolist()
+    classes = classify_frame(df)
+    shift_indices = np.flatnonzero(classes == ROW_SHIFT).tolist()
+    classes = classes.tolist()
+    employees = []
+    unknown_counter = 1
+    next_free = 0  # rows before this were already used as an hours row
+    for i in shift_indices:
+        if i < next_free:
+            continue
+        shift_row = rows[i]
+        emp_code = employee_code(shift_row[0])
+        if emp_code is None:
+            emp_code = f"unknown_{unknown_counter}"
+            unknown_counter += 1
+        hours_row = None
+        if i + 1 < len(rows):
+            next_row = rows[i + 1]
+            if classes[i + 1] == ROW_HOURS or is_hours_row(next_row):
+                hours_row = next_row
+                next_free = i + 2
+        employees.append({
+            "code": emp_code,
+            "name": shift_row[1] if shift_row[1] is not None else "",
+            "shift_row": shift_row,
+            "hours_row": hours_row
+        })
+    return employees
+
+# The weekday labels (row 4) and day-of-month numbers (row 5) of a sheet's 31 day
+# columns, with missing cells as None, each date as used for ordering days (its
+# integer value, 0 if it isn't a number), the weekday of each column (0 is Monday)
+# and whether it is a public holiday. Shared by all rosters of the sheet.
+SheetCalendar = namedtuple("SheetCalendar", ["days", "dates", "day_values", "weekdays", "holidays"])
+
+class EmployeeRoster:
+    """
+    One employee's days on one sheet, as the parser produces them and the
+    calculation engines consume them. Day d has the shift code shifts[d]
+    (converted by convert_shift_value; equal cells share one string) and the
+    hours hours[d] (parsed by parse_hours, in a float array); its date and
+    weekday label come from the sheet's calendar.
+    """
+    __slots__ = ("code", "name", "calendar", "shifts", "hours")
+
+    def __init__(self, code, name, calendar, shifts, hours):
+        self.code = code
+        self.name = name
+        self.calendar = calendar
+        self.shifts = shifts
+        self.hours = hours
+
+    def __len__(self):
+        return len(self.shifts)
+
+    def __repr__(self):
+        return f"EmployeeRoster({self.code!r}, {self.name!r}, {len(self)} days)"
+
+def read_calendar(calendar_rows):
+    """
+    The SheetCalendar of a sheet from its leading rows: day-of-week labels are
+    expected in row 4 and day-of-month in row 5 (columns 3..33). None if the
+    sheet has fewer than 6 rows.
+    """
+    if len(calendar_rows) < 6:
+        return None
+    day_of_week_labels = calendar_rows[4][3:3+31]
+    day_numbers = calendar_rows[5][3:3+31]
+    days = [None if pd.isna(label) else label for label in day_of_week_labels]
+    dates = [None if pd.isna(number) else number for number in day_numbers]
+    days.extend([None] * (31 - len(days)))
+    dates.extend([None] * (31 - len(dates)))
+    day_values = []
+    for date in dates:
+        try:
+            day_values.append(int(str(date)) if date is not None and str(date).isdigit() else 0)
+        except ValueError:
+            day_values.append(0)
+    weekdays = infer_weekdays(days, dates, day_values)
+    return SheetCalendar(days, dates, day_values, weekdays, (False,) * len(days))
+
+def infer_weekdays(days, dates, day_values):
+    """
+    The weekday (0 is Monday) of each calendar column, counted from the first
+    column in date order whose label is an unambiguous day letter (see
+    unambiguous_map). Without one, the first date is taken to be a Monday.
+    """
+    reference_index = None
+    reference_date = None
+    columns = sorted(range(len(days)), key=day_values.__getitem__)
+    for column in columns:
+        if days[column] in unambiguous_map:
+            reference_index = unambiguous_map[days[column]]
+            try:
+                reference_date = int(str(dates[column]))
+            except:
+                reference_date = 1
+            app.logger.debug("Found reference: date %s with day letter %s -> index %s", reference_date, days[column], reference_index)
+            break
+    if reference_index is None:
+        reference_index = 0
+        first_date = dates[columns[0]] if columns else None
+        if first_date and str(first_date).isdigit():
+            reference_date = int(str(first_date))
+        else:
+            reference_date = 1
+        app.logger.debug("No unambiguous day found. Defaulting to Monday for date %s", reference_date)
+    return tuple((reference_index + (day_value - reference_date)) % 7 for day_value in day_values)
+
+def parse_month(text):
+    """(year, month) from a "YYYY-MM" string, as sent by an <input type="month">."""
+    match = re.fullmatch(r"(\d{4})-(\d{1,2})", text.strip())
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        raise ValueError(f"Invalid month '{text}', expected YYYY-MM.")
+    return int(match.group(1)), int(match.group(2))
+
+def load_holidays(path=None):
+    """The public holidays listed in the JSON file at `path` (["YYYY-MM-DD", ...]) as dates."""
+    if not path:
+        return frozenset()
+    with open(path, encoding="utf-8") as f:
+        return frozenset(datetime.date.fromisoformat(day) for day in json.load(f))
+
+# Public holidays, from the JSON file named by HOLIDAYS_FILE. They apply to jobs
+# given the month of the roster.
+HOLIDAYS = load_holidays(os.environ.get("HOLIDAYS_FILE"))
+HOLIDAYS_FINGERPRINT = hashlib.sha256(
+    json.dumps(sorted(day.isoformat() for day in HOLIDAYS)).encode("utf-8")
+).hexdigest()[:16]
+
+def resolve_calendar(calendar, month=None, holidays=frozenset()):
+    """
+    The SheetCalendar with the weekdays of `month` ((year, month)) instead of the
+    inferred ones, for columns whose date exists in that month, and with those
+    dates that are in `holidays` flagged. Holidays need the month to be known.
+    """
+    if month is None:
+        return calendar
+    year, month_number = month
+    last_day = monthrange(year, month_number)[1]
+    weekdays = list(calendar.weekdays)
+    holiday_flags = list(calendar.holidays)
+    for column, day_value in enumerate(calendar.day_values):
+        if 1 <= day_value <= last_day:
+            day = datetime.date(year, month_number, day_value)
+            weekdays[column] = day.weekday()
+            holiday_flags[column] = day in holidays
+    return calendar._replace(weekdays=tuple(weekdays), holidays=tuple(holiday_flags))
+
+def with_calendar(rosters, month=None, holidays=frozenset()):
+    """
+    The rosters with their sheet calendars passed through resolve_calendar (once
+    per sheet), or `rosters` itself when no month is given.
+    """
+    if month is None:
+        return rosters
+    resolved = {}
+    result = []
+    for roster in rosters:
+        key = id(roster.calendar)
+        if key not in resolved:
+            resolved[key] = resolve_calendar(roster.calendar, month, holidays)
+        result.append(EmployeeRoster(roster.code, roster.name, resolved[key], roster.shifts, roster.hours))
+    return result
+
+def parse_days_into_rosters(calendar_rows, employees):
     """
-    For each employee, produce a list of dictionaries (one per day) with keys:
-      code, name, date, shift, hours, day
-    Assumes day-of-week labels are in row 4 and day-of-month in row 5 (columns 3..33).
-    Uses pd.isna() to handle missing values.
+    For each employee with an hours row, produce an EmployeeRoster of the day
+    columns both rows reach (at most 31). Shift codes and hours are converted
+    once per distinct cell value of the sheet.
     """
-    if df.shape[0] < 6:
+    calendar = read_calendar(calendar_rows)
+    if calendar is None:
         return []
-    day_of_week_labels = df.iloc[4, 3:3+31].tolist()
-    day_numbers = df.iloc[5, 3:3+31].tolist()
-    all_records = []
+    shift_values = {}
+    hour_values = {}
+    rosters = []
     for emp in employees:
         shift_row = emp["shift_row"]
         hours_row = emp["hours_row"]
         if hours_row is None:
             continue
-        for day_idx in range(31):
-            col_index = 3 + day_idx
-            if col_index >= len(shift_row) or col_index >= len(hours_row):
-                continue
-            shift_val = shift_row[col_index]
-            hours_val = hours_row[col_index]
-            if pd.isna(shift_val):
-                shift_val = None
-            if pd.isna(hours_val):
-                hours_val = None
-            shift_val = convert_shift_value(shift_val)
-            day_label = day_of_week_labels[day_idx] if day_idx < len(day_of_week_labels) else None
-            day_number = day_numbers[day_idx] if day_idx < len(day_numbers) else None
-            if pd.isna(day_label):
-                day_label = None
-            if pd.isna(day_number):
-                day_number = None
-            record = {
-                "code": emp["code"],
-                "name": emp["name"],
-                "date": day_number,
-                "shift": shift_val,
-                "hours": hours_val,
-                "day": day_label
-            }
-            all_records.append(record)
-    return all_records
+        day_count = min(31, len(shift_row) - 3, len(hours_row) - 3)
+        if day_count <= 0:
+            continue
+        shifts = []
+        hours = array("d")
+        for shift_val, hours_val in zip(shift_row[3:3+day_count], hours_row[3:3+day_count]):
+            if shift_val not in shift_values:
+                shift_values[shift_val] = convert_shift_value(shift_val)
+            shifts.append(shift_values[shift_val])
+            if hours_val not in hour_values:
+                hour_values[hours_val] = parse_hours(hours_val)
+            hours.append(hour_values[hours_val])
+        rosters.append(EmployeeRoster(emp["code"], emp["name"], calendar, shifts, hours))
+    return rosters
 
 # ---------- STEP 2: Combine All Sheets ----------
 
-def read_and_combine_all_sheets(file_path):
+_parse_executor = None
+_parse_executor_lock = threading.Lock()
+
+def parse_sheet(sheet_name, rows):
+    """Parses one sheet's rows into (employees, rosters)."""
+    app.logger.info(f"Processing sheet: {sheet_name}")
+    calendar_rows = []
+    employees = extract_employee_rows(keep_leading_rows(rows, calendar_rows))
+    rosters = parse_days_into_rosters(calendar_rows, employees)
+    return employees, rosters
+
+def parse_frame(sheet_name, df):
+    """parse_sheet for a DataFrame from read_all_sheets."""
+    app.logger.info(f"Processing sheet: {sheet_name}")
+    employees = extract_frame_employee_rows(df)
+    rosters = parse_days_into_rosters(df.iloc[:6].values.tolist(), employees)
+    return employees, rosters
+
+def parse_sheet_subset(file_path, sheet_indices):
+    """
+    Runs in a parse pool worker: opens the workbook read-only and parses only the
+    sheets at positions `sheet_indices` (other sheets are skipped without reading
+    their rows). Returns [(sheet_index, employees, rosters), ...].
+    """
+    wanted = set(sheet_indices)
+    parsed = []
+    for sheet_index, (sheet_name, rows) in enumerate(iter_workbook_rows(file_path)):
+        if sheet_index in wanted:
+            parsed.append((sheet_index, *parse_sheet(sheet_name, rows)))
+    return parsed
+
+def get_parse_executor():
+    """
+    Process pool for parallel sheet parsing, created on first use with PARSE_WORKERS
+    processes. It is shut down when the process owning it exits.
+    """
+    global _parse_executor
+    with _parse_executor_lock:
+        if _parse_executor is None:
+            _parse_executor = ProcessPoolExecutor(
+                max_workers=app.config["PARSE_WORKERS"],
+                mp_context=multiprocessing.get_context(app.config["JOB_START_METHOD"])
+            )
+            # multiprocessing joins the children of an exiting process (e.g. a job
+            # process replaced after JOB_MAX_TASKS jobs, or a batch pool worker)
+            # before atexit handlers run, so the idle parse processes would keep it
+            # waiting forever; finalizers with an exit priority run before that join.
+            # The pool's queues close in finalizers of priority 10, so this goes first.
+            multiprocessing.util.Finalize(_parse_executor, _parse_executor.shutdown, exitpriority=20)
+        return _parse_executor
+
+def read_and_combine_all_sheets(file_path, engine=None, workers=None, counts=None):
     """
-    Reads every sheet from the Excel file, merges them into a single list of daily records.
+    Reads every sheet from the Excel file, merges them into a single list of EmployeeRosters.
+    Sheets are streamed row by row unless `engine` (or INGEST_ENGINE) selects "pandas".
+    With more than one worker (`workers` or PARSE_WORKERS) the streamed sheets are
+    split across a process pool; rosters are merged back in sheet order, so the
+    output is the same as parsing sequentially.
+    If `counts` is a dict, the number of sheets read is stored in counts["sheets"].
     """
-    df_dict = read_all_sheets(file_path)
+    engine = engine or app.config["INGEST_ENGINE"]
+    workers = workers or app.config["PARSE_WORKERS"]
+    if workers > 1 and engine == "openpyxl" and not is_delimited(file_path):
+        parsed_sheets = parse_sheets_in_parallel(file_path, workers)
+    elif engine == "pandas" and not is_delimited(file_path):
+        parsed_sheets = (parse_frame(sheet_name, df) for sheet_name, df in read_all_sheets(file_path).items())
+    else:
+        parsed_sheets = (parse_sheet(sheet_name, rows) for sheet_name, rows in iter_sheets(file_path, engine))
     all_employees = []
-    all_daily_records = []
-    for sheet_name, df in df_dict.items():
-        app.logger.info(f"Processing sheet: {sheet_name}")
-        employees = extract_employee_rows(df)
+    all_rosters = []
+    sheet_count = 0
+    for employees, rosters in parsed_sheets:
+        sheet_count += 1
         all_employees.extend(employees)
-        daily_records = parse_days_into_dicts(df, employees)
-        all_daily_records.extend(daily_records)
-    return all_employees, all_daily_records
+        all_rosters.extend(rosters)
+    if counts is not None:
+        counts["sheets"] = sheet_count
+    return all_employees, all_rosters
+
+def parse_sheets_in_parallel(file_path, workers):
+    """
+    Deals the sheets round-robin to up to `workers` pool processes and returns
+    [(employees, rosters), ...] in workbook order.
+    """
+    wb = openpyxl.load_workbook(file_path, read_only=True, keep_links=False)
+    sheet_count = len(wb.worksheets)
+    wb.close()
+    workers = min(workers, sheet_count)
+    if workers <= 1:
+        return [parse_sheet(sheet_name, rows) for sheet_name, rows in iter_workbook_rows(file_path)]
+    executor = get_parse_executor()
+    futures = [
+        executor.submit(parse_sheet_subset, file_path, list(range(start, sheet_count, workers)))
+        for start in range(workers)
+    ]
+    parsed = [item for future in futures for item in future.result()]
+    parsed.sort(key=lambda item: item[0])
+    return [(employees, rosters) for _, employees, rosters in parsed]
 
 # ---------- STEP 3: Advanced Logic for Overtime and Sunday Work ----------
 
@@ -183,16 +694,14 @@ def parse_hours(value):
     If the value is missing (NaN or empty string), returns 0.0.
     """
     if pd.isna(value):
-        app.logger.debug(f"parse_hours: Value is missing, returning 0.0")
         return 0.0
     value_str = str(value).strip()
     if value_str.lower() == "nan" or value_str == "":
-        app.logger.debug(f"parse_hours: Found '{value}' so returning 0.0")
         return 0.0
     try:
         return float(value_str)
     except (ValueError, TypeError):
-        app.logger.debug(f"parse_hours: Could not convert '{value}' to float, returning 0.0")
+        app.logger.debug("parse_hours: Could not convert %r to float, returning 0.0", value)
         return 0.0
 
 # Mapping day index to English names and unambiguous mapping:
@@ -211,309 +720,2104 @@ unambiguous_map = {
     "Н": 6
 }
 
-def process_employee_entries(entries, monthly_hours):
+# ---------- Shift Code Registry ----------
+
+# What one day of each shift code contributes to the result columns. Codes are
+# matched case-insensitively and "," is read as "." (so "Д17,5" is "д17.5").
+# Values are fixed hours or one of SHIFT_AMOUNTS:
+#   "hours"        - the hours worked that day
+#   "hours_over_8" - only the hours above 8
+#   "overtime"     - the overtime portion of that day
+# "duty": true marks duty shifts that do not count towards working hours or overtime,
+# so they never earn overtime_sunday/overtime_saturday.
+# Extra or overriding codes can be loaded from the JSON file named by SHIFT_CODES_FILE.
+SHIFT_CODES = {
+    "1": {"first": 8, "sunday": 8, "overtime_sunday": 8},
+    "1/2": {"first": 8, "second": "hours_over_8", "sunday": "hours", "overtime_sunday": "overtime"},
+    "2": {"second": 8, "overtime_sunday": 8},
+    "2/3": {"second": "hours", "third": 8, "sunday": 10, "saturday": 6, "overtime_sunday": 10, "overtime_saturday": 6},
+    "3": {"second": 8, "third": 8, "sunday": 2, "saturday": 6, "overtime_sunday": 2, "overtime_saturday": 6},
+    "24": {"first": 8, "second": 16, "third": 8, "sunday": 18, "saturday": 6, "overtime_sunday": 18, "overtime_saturday": 6},
+    "1/2/3": {"first": 8, "second": 16, "third": 8, "sunday": 18, "saturday": 6, "overtime_sunday": 18, "overtime_saturday": 6},
+    "го": {"first": 8},
+    "сл": {"first": 8},
+    "д": {"duty": True, "dezurstva": "hours", "per_dezurstvo": 8, "sunday": 18, "saturday": 6},
+    "дпр": {"duty": True, "holidays": "hours", "per_dezurstvo": 8, "sunday": 18, "saturday": 6},
+    "д8": {"duty": True, "dezurstva": "hours", "per_dezurstvo": 8},
+    "д16": {"duty": True, "dezurstva": "hours", "per_dezurstvo": 8, "sunday": 18},
+    "д24": {"dezurstva": "hours", "per_dezurstvo": 8, "sunday": 18, "saturday": 6, "overtime_saturday": 6},
+    "д11": {"dezurstva": "hours", "per_dezurstvo": 8},
+    "д17.5": {"dezurstva": "hours", "per_dezurstvo": 8, "sunday": 18},
+}
+SHIFT_AMOUNTS = ("hours", "hours_over_8", "overtime")
+# Registry keys that add to a result column on every day the code appears.
+SHIFT_DAILY_FIELDS = {
+    "first": "first shift",
+    "second": "second+third shift",
+    "third": "third shift",
+    "holidays": "holidays",
+    "dezurstva": "dezurstva",
+    "per_dezurstvo": "hours per dezurstvo",
+}
+# Registry keys that only apply on Sundays/Saturdays (and, for overtime_*, on days with overtime).
+SHIFT_WEEKDAY_FIELDS = ("sunday", "saturday", "overtime_sunday", "overtime_saturday")
+
+# counts: hours count towards total working hours and overtime.
+# daily: ((result column, amount), ...) added every day.
+# sunday/saturday/overtime_sunday/overtime_saturday: amount or None.
+ShiftRule = namedtuple(
+    "ShiftRule", ["code", "counts", "daily", "sunday", "saturday", "overtime_sunday", "overtime_saturday"]
+)
+UNKNOWN_SHIFT_RULE = ShiftRule(None, True, (), None, None, None, None)
+
+def normalize_shift_code(shift):
+    """Canonical registry key for a shift code: stripped, lowercase, ',' read as '.'."""
+    if shift is None:
+        return None
+    return str(shift).strip().casefold().replace(",", ".")
+
+def _compile_amount(code, field, value):
+    if isinstance(value, str):
+        if value not in SHIFT_AMOUNTS:
+            raise ValueError(f"Shift code '{code}': {field} must be a number or one of {SHIFT_AMOUNTS}, got '{value}'")
+        return value
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"Shift code '{code}': {field} must be a number or one of {SHIFT_AMOUNTS}, got {value!r}")
+    return float(value)
+
+def compile_shift_codes(shift_codes):
     """
-    Process a list of daily records for one employee.
-    Calculates total hours, overtime (total_hours - monthly_hours),
-    and computes "overtime sunday work" based on overtime portions.
-    (Duty shifts are not counted in total working hours or overtime.)
+    Compiles a registry mapping (see SHIFT_CODES) into {normalized code: ShiftRule},
+    so evaluating a day is a single dict lookup.
     """
-    entries_sorted = sorted(
-        entries,
-        key=lambda x: int(str(x["date"])) if x["date"] is not None and str(x["date"]).isdigit() else 0
+    known_fields = {"duty", *SHIFT_DAILY_FIELDS, *SHIFT_WEEKDAY_FIELDS}
+    rules = {}
+    for code, spec in shift_codes.items():
+        unknown = set(spec) - known_fields
+        if unknown:
+            raise ValueError(f"Shift code '{code}': unknown fields {sorted(unknown)}")
+        key = normalize_shift_code(code)
+        rules[key] = ShiftRule(
+            code=key,
+            counts=not spec.get("duty", False),
+            daily=tuple(
+                (column, _compile_amount(code, field, spec[field]))
+                for field, column in SHIFT_DAILY_FIELDS.items() if field in spec
+            ),
+            **{
+                field: _compile_amount(code, field, spec[field]) if field in spec else None
+                for field in SHIFT_WEEKDAY_FIELDS
+            }
+        )
+    return rules
+
+def load_shift_codes(path=None):
+    """SHIFT_CODES, extended/overridden by the codes in the JSON file at `path` (if any)."""
+    shift_codes = dict(SHIFT_CODES)
+    if path:
+        with open(path, encoding="utf-8") as f:
+            shift_codes.update(json.load(f))
+    return shift_codes
+
+ACTIVE_SHIFT_CODES = load_shift_codes(os.environ.get("SHIFT_CODES_FILE"))
+SHIFT_RULES = compile_shift_codes(ACTIVE_SHIFT_CODES)
+# Identifies the active registry in cache keys, so changing it invalidates cached results.
+SHIFT_CODES_FINGERPRINT = hashlib.sha256(
+    json.dumps(ACTIVE_SHIFT_CODES, sort_keys=True).encode("utf-8")
+).hexdigest()[:16]
+
+@lru_cache(maxsize=1024)
+def lookup_shift_rule(shift):
+    """The compiled ShiftRule for a raw shift code (UNKNOWN_SHIFT_RULE if not registered)."""
+    return SHIFT_RULES.get(normalize_shift_code(shift), UNKNOWN_SHIFT_RULE)
+
+@lru_cache(maxsize=1024)
+def holiday_shift_rule(rule):
+    """
+    The rule as it applies on a public holiday: duty hours ("dezurstva") count
+    as duty on a holiday ("holidays"), unless the rule has its own holidays amount.
+    """
+    columns = {column for column, _ in rule.daily}
+    daily = tuple(
+        ("holidays" if column == "dezurstva" and "holidays" not in columns else column, amount)
+        for column, amount in rule.daily
+        if not (column == "dezurstva" and "holidays" in columns)
     )
-    reference_index = None
-    reference_date = None
-    for entry in entries_sorted:
-        if entry["day"] in unambiguous_map:
-            reference_index = unambiguous_map[entry["day"]]
-            try:
-                reference_date = int(str(entry["date"]))
-            except:
-                reference_date = 1
-            app.logger.debug(f"Found reference: date {reference_date} with day letter {entry['day']} -> index {reference_index}")
-            break
-    if reference_index is None:
-        reference_index = 0
-        if entries_sorted and entries_sorted[0]["date"] and str(entries_sorted[0]["date"]).isdigit():
-            reference_date = int(str(entries_sorted[0]["date"]))
+    return rule._replace(daily=daily)
+
+def shift_amount(amount, hours_worked, overtime_today):
+    """Resolves a compiled amount (fixed hours or a SHIFT_AMOUNTS name) for one day."""
+    if amount == "hours":
+        return hours_worked
+    if amount == "hours_over_8":
+        extra = hours_worked - 8
+        return extra if extra > 0 else 0.0
+    if amount == "overtime":
+        return overtime_today
+    return amount
+
+def employee_days(rosters):
+    """
+    The days of one employee's rosters as (day value, weekday label, weekday,
+    holiday, shift, hours) tuples, ordered by date; days with equal dates keep
+    sheet order. Weekdays and holidays come from each sheet's calendar.
+    """
+    days = []
+    for roster in rosters:
+        calendar = roster.calendar
+        days.extend(zip(
+            calendar.day_values, calendar.days, calendar.weekdays, calendar.holidays, roster.shifts, roster.hours
+        ))
+    days.sort(key=itemgetter(0))
+    return days
+
+# One precomputed day of an employee: (day value, weekday label, weekday name, holiday,
+# shift, hours worked, counts towards overtime, weekend amount, weekend overtime amount,
+# ((daily column, amount), ...)). Amounts are resolved to hours, except "overtime"
+# which the overtime pass fills in; missing weekend amounts are None.
+PrecomputedEmployee = namedtuple("PrecomputedEmployee", ["code", "name", "days", "cumulative"])
+
+def resolve_amount(amount, hours_worked):
+    """shift_amount for the amounts that don't depend on overtime; None and "overtime" are kept."""
+    if amount is None or amount == "overtime":
+        return amount
+    return shift_amount(amount, hours_worked, 0.0)
+
+def precompute_employee(rosters):
+    """
+    The monthly_hours-independent part of process_employee_entries for one
+    employee, given as their EmployeeRosters: orders the days, looks up weekdays,
+    holidays and shift rules, and accumulates the counted hours. `cumulative`
+    holds the counted hours before each day plus the total at the end, so the
+    overtime pass (apply_monthly_hours) never has to look at the rosters again.
+    """
+    code = rosters[0].code
+    name = rosters[0].name
+
+    # Only count hours for overtime/total if it's NOT a duty shift.
+    cumulative = array("d", [0.0])
+    counted = 0.0
+    precomputed_days = []
+    for day_val, day_label, weekday, holiday, shift, hours_worked in employee_days(rosters):
+        actual_day = day_index_to_name[weekday]
+        rule = lookup_shift_rule(shift)
+        if holiday:
+            rule = holiday_shift_rule(rule)
+        if rule.counts:
+            counted += hours_worked
+        cumulative.append(counted)
+
+        # Sunday work (Saturday shifts also earn Sunday work hours), regardless of counting for overtime
+        if actual_day == "Sunday":
+            weekend_amount = rule.sunday
+            overtime_amount = rule.overtime_sunday
+        elif actual_day == "Saturday":
+            weekend_amount = rule.saturday
+            overtime_amount = rule.overtime_saturday
         else:
-            reference_date = 1
-        app.logger.debug(f"No unambiguous day found. Defaulting to Monday for date {reference_date}")
+            weekend_amount = overtime_amount = None
+        precomputed_days.append((
+            day_val, day_label, actual_day, holiday, shift, hours_worked, rule.counts,
+            resolve_amount(weekend_amount, hours_worked),
+            resolve_amount(overtime_amount, hours_worked),
+            tuple((column, resolve_amount(amount, hours_worked)) for column, amount in rule.daily)
+        ))
+    return PrecomputedEmployee(code, name, precomputed_days, cumulative)
 
-    total_hours = 0.0
-    cumulative = 0.0
+def apply_monthly_hours(employee, monthly_hours, trace=None):
+    """
+    The overtime pass of process_employee_entries over a PrecomputedEmployee:
+    splits each day's counted hours at `monthly_hours` and adds up the result
+    columns in date order. If `trace` is a list, one record per day with what
+    that day contributed is appended to it (see TRACE_COLUMNS).
+    """
+    code = employee.code
+    name = employee.name
+    cumulative = employee.cumulative
     overtime_sunday_work = 0.0  # Прекувремена работа во недела
     sunday_work_hours = 0.0
-    first_shift_hours = 0.0
-    second_third_hours = 0.0
-    third_shift_hours = 0.0
-    holidays = 0.0
-    dezurstva = 0.0
-    hours_per_dezurstvo = 0.0
-
-    # Define the duty shifts that should not count towards working hours/overtime
-    duty_shifts = {"д", "Д", "дпр", "ДПР", "д8", "Д8", "д16", "Д16"}
-
-    app.logger.info(f"Processing employee {entries_sorted[0]['name']} (code: {entries_sorted[0]['code']})")
-    for entry in entries_sorted:
-        try:
-            day_val = int(str(entry["date"])) if entry["date"] is not None and str(entry["date"]).isdigit() else 0
-        except:
-            day_val = 0
-        day_index = (reference_index + (day_val - reference_date)) % 7
-        actual_day = day_index_to_name[day_index]
-        shift = entry["shift"]
-        hours_worked = parse_hours(entry["hours"])
-
-        # Only count hours for overtime/total if it's NOT a duty shift.
-        if shift not in duty_shifts:
-            total_hours += hours_worked
-            if cumulative >= monthly_hours:
+    totals = dict.fromkeys(SHIFT_DAILY_FIELDS.values(), 0.0)
+
+    app.logger.debug("Processing employee %s (code: %s)", name, code)
+    for i, day in enumerate(employee.days):
+        day_val, day_label, actual_day, holiday, shift, hours_worked, counts, weekend_amount, overtime_amount, daily = day
+        if counts:
+            if cumulative[i] >= monthly_hours:
                 overtime_today = hours_worked
-            elif cumulative + hours_worked > monthly_hours:
-                overtime_today = (cumulative + hours_worked) - monthly_hours
+            elif cumulative[i + 1] > monthly_hours:
+                overtime_today = cumulative[i + 1] - monthly_hours
             else:
                 overtime_today = 0.0
-            cumulative += hours_worked
         else:
             # For duty shifts, we do not add their hours to total working hours or cumulative overtime.
             overtime_today = 0.0
 
-        log_message = f"Date: {day_val}, Day: {entry['day']} -> {actual_day}, Shift: {shift}, Hours: {hours_worked}"
+        sunday_extra = 0.0
+        if weekend_amount is not None:
+            sunday_extra = overtime_today if weekend_amount == "overtime" else weekend_amount
+            sunday_work_hours += sunday_extra
 
-        # Existing Sunday work adjustments remain (they are processed regardless of counting for overtime)
-        if actual_day == "Sunday":
-            if shift in {"24", "1/2/3"}:
-                sunday_work_hours += 18
-                log_message += " | Sunday shift '24'/'1/2/3' => +18h"
-            elif shift == "2/3":
-                sunday_work_hours += 10
-                log_message += " | Sunday shift '2/3' => +10h"
-            elif shift == "3":
-                sunday_work_hours += 2
-                log_message += " | Sunday shift '3' => +2h"
-            elif shift == "1/2":
-                sunday_work_hours += hours_worked
-                log_message += f" | Sunday shift '1/2' => +{hours_worked}h"
-            elif shift in {"д", "Д", "дпр", "ДПР", "Д16", "д16", "Д24","д24","д17,5","Д17,5","д17.5","Д17.5"}:
-                sunday_work_hours += 18
-                log_message += f" | Sunday duty shift '{shift}' => +18h"
-            elif shift == "1":
-                sunday_work_hours += 8
-                log_message += " | Sunday shift '1' => +8h"
-        elif actual_day == "Saturday" and shift in {"24", "1/2/3", "2/3", "3", "д", "Д", "дпр", "ДПР","Д24","д24"}:
-            sunday_work_hours += 6
-            log_message += " | Saturday shift => +6h for Sunday"
-
-        # Count shift-specific hours (these branches still run even for duty shifts)
-        if shift == "1":
-            first_shift_hours += 8
-            log_message += " | shift '1' => first shift +8"
-        elif shift == "1/2":
-            first_shift_hours += 8
-            extra = hours_worked - 8
-            if extra > 0:
-                second_third_hours += extra
-                log_message += f" | shift '1/2' => first +8, second +{extra}"
-            else:
-                log_message += " | shift '1/2' => first +8"
-        elif shift == "2":
-            second_third_hours += 8
-            log_message += " | shift '2' => second +8"
-        elif shift == "2/3":
-            second_third_hours += hours_worked
-            third_shift_hours += 8
-            log_message += " | shift '2/3' => second +8, third +8"
-        elif shift == "3":
-            second_third_hours += 8
-            third_shift_hours += 8
-            log_message += " | shift '3' => second +8, third +8"
-        elif shift in {"1/2/3", "24"}:
-            first_shift_hours += 8
-            second_third_hours += 16
-            third_shift_hours += 8
-            log_message += " | shift '1/2/3'/'24' => first +8, second +8, third +8"
-        elif shift in {"ГО", "го", "Го"}:
-            first_shift_hours += 8
-            log_message += " | shift 'ГО' (case-insensitive) => first shift +8"
-        elif shift in {"СЛ", "сл", "Сл"}:
-            first_shift_hours += 8
-            log_message += " | shift 'СЛ' (case-insensitive) => first shift +8"
-        elif shift in {"дпр", "ДПР"}:
-            holidays += hours_worked
-            hours_per_dezurstvo += 8
-            log_message += f" | shift '{shift}' => holidays +{hours_worked}, dezurstvo +8"
-        elif shift in {"д", "Д", "Д8", "д8", "Д16", "д16","Д24","д24","д11","Д11","д17,5","Д17,5","д17.5","Д17.5"}:
-            dezurstva += hours_worked
-            hours_per_dezurstvo += 8
-            log_message += f" | shift '{shift}' => dezurstva +{hours_worked}, dezurstvo +8"
+        # Shift-specific hours (these still count for duty shifts)
+        for column, amount in daily:
+            totals[column] += overtime_today if amount == "overtime" else amount
 
         # Overtime Sunday Work Adjustment (only for non-duty shifts since overtime_today is 0 for duty)
-        if overtime_today > 0:
-            if actual_day == "Sunday":
-                if shift in {"24", "1/2/3", "д", "Д", "дпр", "ДПР"}:
-                    overtime_sunday_work += 18
-                    log_message += " | Overtime Sunday: fixed +18h"
-                elif shift == "2/3":
-                    overtime_sunday_work += 10
-                    log_message += " | Overtime Sunday: fixed +10h"
-                elif shift == "3":
-                    overtime_sunday_work += 2
-                    log_message += " | Overtime Sunday: fixed +2h"
-                elif shift == "1/2":
-                    overtime_sunday_work += overtime_today
-                    log_message += f" | Overtime Sunday: using overtime portion +{overtime_today}h"
-                elif shift in {"1", "2"}:
-                    overtime_sunday_work += 8
-                    log_message += " | Overtime Sunday: fixed +8h"
-            elif actual_day == "Saturday":
-                if shift in {"24", "1/2/3", "д", "2/3", "3", "Д", "дпр", "ДПР", "Д24","д24"}:
-                    overtime_sunday_work += 6
-                    log_message += " | Overtime Saturday: fixed +6h"
-                elif shift == "2/3":
-                    overtime_sunday_work += 6
-                    log_message += " | Overtime Saturday: fixed +6h"
-                elif shift == "3":
-                    overtime_sunday_work += 2
-                    log_message += " | Overtime Saturday: fixed +2h"
-
-        app.logger.debug(log_message)
+        overtime_extra = 0.0
+        if overtime_today > 0 and overtime_amount is not None:
+            overtime_extra = overtime_today if overtime_amount == "overtime" else overtime_amount
+            overtime_sunday_work += overtime_extra
 
+        if trace is not None:
+            day_record = {
+                "code": code,
+                "name": name,
+                "date": day_val,
+                "day": day_label,
+                "weekday": actual_day,
+                "holiday": holiday,
+                "shift": shift,
+                "hours": hours_worked,
+                "counts": counts,
+                "overtime": overtime_today,
+                "sunday work": sunday_extra,
+                "overtime sunday work": overtime_extra,
+                **dict.fromkeys(SHIFT_DAILY_FIELDS.values(), 0.0)
+            }
+            for column, amount in daily:
+                day_record[column] = overtime_today if amount == "overtime" else amount
+            trace.append(day_record)
+
+    total_hours = cumulative[-1]
     overtime = total_hours - monthly_hours
-    app.logger.info(f"Total hours: {total_hours}, Cumulative overtime: {overtime}, Overtime Sunday Work: {overtime_sunday_work}")
+    app.logger.debug("Total hours: %s, Cumulative overtime: %s, Overtime Sunday Work: %s", total_hours, overtime, overtime_sunday_work)
     return {
-        "code": entries_sorted[0]["code"] if entries_sorted else "",
-        "name": entries_sorted[0]["name"] if entries_sorted else "",
+        "code": code,
+        "name": name,
         "total_hours": total_hours,  # Total working hours (excluding duty shifts)
         "overtime": overtime,
         "sunday work": sunday_work_hours,
         "overtime sunday work": overtime_sunday_work,
-        "first shift": first_shift_hours,
-        "second+third shift": second_third_hours,
-        "third shift": third_shift_hours,
-        "holidays": holidays,
-        "dezurstva": dezurstva,
-        "hours per dezurstvo": hours_per_dezurstvo
+        **totals
     }
 
-def generate_result_xlsx(results, output_path):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Резултати"
-    # Updated headers with "Вкупно работни часови" after the name column:
-    headers = [
-        "Шифра", 
-        "Име и Презиме", 
-        "Вкупно работни часови",  # Total Working Hours after the name
-        "Прва смена", 
-        "Втора и Трета смена заедно", 
-        "Трета смена", 
-        "Ноќна работа дежурство по час",
-        "Дежурство на празник", 
-        "Дежурство", 
-        "Работа во Недела", 
-        "Прекувремена работа во недела",
-        "Прекувремена работа", 
+def process_employee_entries(rosters, monthly_hours, trace=None):
+    """
+    Process the days of one employee, given as their EmployeeRosters (one per
+    sheet they appear on).
+    Calculates total hours, overtime (total_hours - monthly_hours),
+    and computes "overtime sunday work" based on overtime portions.
+    (Duty shifts are not counted in total working hours or overtime.)
+    If `trace` is a list, one record per day with what that day contributed is
+    appended to it (see TRACE_COLUMNS).
+    """
+    return apply_monthly_hours(precompute_employee(rosters), monthly_hours, trace)
+
+# ---------- STEP 4: Vectorized Engine (all employees at once) ----------
+
+CALC_ENGINES = ("python", "vectorized")
+
+# Per-day arrays of every employee, grouped by employee in first-seen order and
+# by date within each group (see precompute_vectorized). `fixed` holds each day's
+# contribution to the CONTRIBUTION_COLUMNS that doesn't depend on overtime;
+# `uses_overtime` marks the entries that are that day's overtime instead.
+PrecomputedTable = namedtuple("PrecomputedTable", [
+    "employees", "group_starts", "group_ends", "emp_ids", "day_vals", "day_labels", "weekday",
+    "holiday", "shifts", "hours", "counts", "cumulative_before", "cumulative_after", "fixed", "uses_overtime",
+])
+CONTRIBUTION_COLUMNS = ("total_hours", "sunday work", "overtime sunday work", *SHIFT_DAILY_FIELDS.values())
+# Only counted on days that have overtime.
+OVERTIME_WEEKEND_COLUMN = CONTRIBUTION_COLUMNS.index("overtime sunday work")
+
+def _amount_parts(amounts, shift_ids, hours_worked):
+    """
+    Per-day values of one registry field, given its compiled amount (or None) for
+    every shift category and each day's category ID, as (values, uses_overtime):
+    days whose amount is "overtime" are flagged instead and have value 0.
+    """
+    kinds = np.array([SHIFT_AMOUNTS.index(a) if isinstance(a, str) else -1 for a in amounts])[shift_ids]
+    fixed = np.array([a if isinstance(a, float) else 0.0 for a in amounts])[shift_ids]
+    extra = hours_worked - 8
+    values = np.select([kinds == 0, kinds == 1], [hours_worked, np.where(extra > 0, extra, 0.0)], fixed)
+    return values, kinds == 2
+
+def precompute_vectorized(rosters):
+    """
+    The monthly_hours-independent part of process_all_entries_vectorized: takes
+    every EmployeeRoster, concatenates their days grouped by (code, name) in
+    first-seen order and returns a PrecomputedTable with the shift rules and
+    per-employee running sums of counted hours resolved (None if there are no
+    rosters). Weekdays and holidays are taken from the sheet calendars. Shift
+    codes are factorized once, so per-code rules run per distinct code instead
+    of per day.
+    """
+    if not rosters:
+        return None
+    group_index = {}
+    roster_groups = [group_index.setdefault((roster.code, roster.name), len(group_index)) for roster in rosters]
+    lengths = [len(roster) for roster in rosters]
+    day_count = sum(lengths)
+    emp_ids = np.repeat(np.array(roster_groups, dtype=np.int64), lengths)
+    day_vals = np.fromiter(
+        chain.from_iterable(roster.calendar.day_values[:len(roster)] for roster in rosters),
+        dtype=np.int64, count=day_count
+    )
+    order = np.lexsort((day_vals, emp_ids))
+
+    def day_column(values):
+        """Object array of per-roster day values, concatenated and sorted like the days."""
+        column = np.empty(day_count, dtype=object)
+        column[:] = list(chain.from_iterable(values))
+        return column[order]
+
+    emp_ids = emp_ids[order]
+    day_vals = day_vals[order]
+    day_labels = day_column(roster.calendar.days[:len(roster)] for roster in rosters)
+    shifts = day_column(roster.shifts for roster in rosters)
+    hours = np.fromiter(chain.from_iterable(roster.hours for roster in rosters), dtype=np.float64, count=day_count)[order]
+    weekday = np.fromiter(
+        chain.from_iterable(roster.calendar.weekdays[:len(roster)] for roster in rosters),
+        dtype=np.int64, count=day_count
+    )[order]
+    holiday = np.fromiter(
+        chain.from_iterable(roster.calendar.holidays[:len(roster)] for roster in rosters),
+        dtype=bool, count=day_count
+    )[order]
+    n_groups = len(group_index)
+    group_starts = np.searchsorted(emp_ids, np.arange(n_groups), side="left")
+    group_ends = np.searchsorted(emp_ids, np.arange(n_groups), side="right")
+    is_sunday = weekday == 6
+    is_saturday = weekday == 5
+
+    # Shift codes: categorical IDs, one registry lookup per distinct code (missing codes
+    # get the ID after the last code). Holidays use the holiday variant of each rule.
+    shift_ids, shift_uniques = pd.factorize(shifts, use_na_sentinel=True)
+    base_rules = [lookup_shift_rule(code) for code in shift_uniques] + [lookup_shift_rule(None)]
+    rules = base_rules + [holiday_shift_rule(rule) for rule in base_rules]
+    shift_ids = np.where(shift_ids < 0, len(shift_uniques), shift_ids) + np.where(holiday, len(base_rules), 0)
+    counts = np.array([rule.counts for rule in rules], dtype=bool)[shift_ids]
+
+    # Running sums are accumulated in date order so the floating point totals match exactly.
+    counted_hours = np.where(counts, hours, 0.0)
+    cumulative_after = np.empty(day_count, dtype=np.float64)
+    cumulative_before = np.empty(day_count, dtype=np.float64)
+    for start, end in zip(group_starts, group_ends):
+        running = np.add.accumulate(counted_hours[start:end])
+        cumulative_after[start:end] = running
+        cumulative_before[start] = 0.0
+        cumulative_before[start + 1:end] = running[:-1]
+
+    def field(name):
+        return _amount_parts([getattr(rule, name) for rule in rules], shift_ids, hours)
+
+    def weekend(sunday_field, saturday_field):
+        sunday_values, sunday_uses = field(sunday_field)
+        saturday_values, saturday_uses = field(saturday_field)
+        return (
+            np.where(is_sunday, sunday_values, 0.0) + np.where(is_saturday, saturday_values, 0.0),
+            (is_sunday & sunday_uses) | (is_saturday & saturday_uses)
+        )
+
+    def daily(column):
+        return _amount_parts([dict(rule.daily).get(column) for rule in rules], shift_ids, hours)
+
+    parts = [
+        (counted_hours, np.zeros(day_count, dtype=bool)),
+        weekend("sunday", "saturday"),
+        weekend("overtime_sunday", "overtime_saturday"),
+        *(daily(column) for column in SHIFT_DAILY_FIELDS.values()),
     ]
-    ws.append(headers)
-    # Update column widths accordingly (12 columns in total)
-    column_widths = [12, 24, 18, 12, 24, 12, 28, 18, 12, 18, 22, 18]
-    for i, width in enumerate(column_widths, start=1):
-        ws.column_dimensions[get_column_letter(i)].width = width
-    for r in results:
-        row = [
-            r["code"],
-            r["name"],
-            r["total_hours"],  # Total working hours now appears after the name
-            r["first shift"],
-            r["second+third shift"],
-            r["third shift"],
-            r["hours per dezurstvo"],
-            r["holidays"],
-            r["dezurstva"],
-            r["sunday work"],
-            r["overtime sunday work"],
-            r["overtime"]
+    return PrecomputedTable(
+        employees=list(group_index),
+        group_starts=group_starts,
+        group_ends=group_ends,
+        emp_ids=emp_ids,
+        day_vals=day_vals,
+        day_labels=day_labels,
+        weekday=weekday,
+        holiday=holiday,
+        shifts=shifts,
+        hours=hours,
+        counts=counts,
+        cumulative_before=cumulative_before,
+        cumulative_after=cumulative_after,
+        fixed=np.column_stack([values for values, _ in parts]),
+        uses_overtime=np.column_stack([uses for _, uses in parts]),
+    )
+
+def apply_monthly_hours_vectorized(table, monthly_hours, trace=None):
+    """
+    The overtime pass of process_all_entries_vectorized over a PrecomputedTable:
+    each day's overtime comes from the running sums, then the contributions are
+    added up per employee. If `trace` is a list, the per-day breakdown is
+    appended to it in the same order and format as process_employee_entries produces.
+    """
+    if table is None:
+        return []
+    overtime_today = np.where(
+        table.cumulative_before >= monthly_hours,
+        table.hours,
+        np.where(table.cumulative_after > monthly_hours, table.cumulative_after - monthly_hours, 0.0)
+    )
+    overtime_today = np.where(table.counts, overtime_today, 0.0)
+    contributions = np.where(table.uses_overtime, overtime_today[:, np.newaxis], table.fixed)
+    contributions[:, OVERTIME_WEEKEND_COLUMN] = np.where(
+        overtime_today > 0, contributions[:, OVERTIME_WEEKEND_COLUMN], 0.0
+    )
+
+    employees = table.employees
+    if trace is not None:
+        weekday_names = np.array([day_index_to_name[i] for i in range(7)], dtype=object)[table.weekday]
+        for i, row in enumerate(contributions[:, 1:].tolist()):
+            sunday_extra, overtime_extra, *daily_extras = row
+            code, name = employees[table.emp_ids[i]]
+            trace.append({
+                "code": code,
+                "name": name,
+                "date": int(table.day_vals[i]),
+                "day": table.day_labels[i],
+                "weekday": weekday_names[i],
+                "holiday": bool(table.holiday[i]),
+                "shift": table.shifts[i],
+                "hours": float(table.hours[i]),
+                "counts": bool(table.counts[i]),
+                "overtime": float(overtime_today[i]),
+                "sunday work": sunday_extra,
+                "overtime sunday work": overtime_extra,
+                **dict(zip(SHIFT_DAILY_FIELDS.values(), daily_extras))
+            })
+    results = []
+    for (code, name), start, end in zip(employees, table.group_starts, table.group_ends):
+        total_hours, sunday_work_hours, overtime_sunday_work, *daily_totals = (
+            float(value) for value in np.add.accumulate(contributions[start:end], axis=0)[-1]
+        )
+        results.append({
+            "code": code,
+            "name": name,
+            "total_hours": total_hours,
+            "overtime": total_hours - monthly_hours,
+            "sunday work": sunday_work_hours,
+            "overtime sunday work": overtime_sunday_work,
+            **dict(zip(SHIFT_DAILY_FIELDS.values(), daily_totals))
+        })
+    return results
+
+def process_all_entries_vectorized(rosters, monthly_hours, trace=None):
+    """
+    Columnar counterpart of process_employee_entries for the whole workbook at once.
+    Returns one result dict per employee, grouped by (code, name) in first-seen
+    order, identical to calling process_employee_entries on each employee's rosters.
+    If `trace` is a list, the per-day breakdown is appended to it.
+    """
+    return apply_monthly_hours_vectorized(precompute_vectorized(rosters), monthly_hours, trace)
+
+def group_by_employee(rosters):
+    """
+    Rosters grouped by (code, name), in order of first appearance. An employee
+    listed on several sheets has one roster per sheet.
+    """
+    emp_dict = {}
+    for roster in rosters:
+        emp_dict.setdefault((roster.code, roster.name), []).append(roster)
+    return emp_dict
+
+def precompute_results(rosters, engine=None, timings=None, month=None):
+    """
+    The part of calculate_results that doesn't depend on monthly_hours, for the
+    selected engine (defaults to CALC_ENGINE): a list of PrecomputedEmployee for
+    "python", a PrecomputedTable for "vectorized". Pass it to calculate_precomputed
+    with the same engine. Given the `month` ((year, month)) of the roster, the
+    weekdays come from that month and HOLIDAYS apply (see resolve_calendar).
+    If `timings` is a dict, the "group" and "precompute" stage durations are added to it.
+    """
+    engine = engine or app.config["CALC_ENGINE"]
+    rosters = with_calendar(rosters, month, HOLIDAYS)
+    if engine == "vectorized":
+        # Grouping is part of the vectorized pass.
+        with timed_stage(timings, "precompute"):
+            return precompute_vectorized(rosters)
+    if engine == "python":
+        with timed_stage(timings, "group"):
+            emp_dict = group_by_employee(rosters)
+        with timed_stage(timings, "precompute"):
+            return [precompute_employee(group) for group in emp_dict.values()]
+    raise ValueError(f"Unknown calculation engine '{engine}', expected one of {CALC_ENGINES}")
+
+def calculate_precomputed(precomputed, monthly_hours, engine=None, trace=None, timings=None):
+    """
+    Runs the overtime pass of the selected engine over the output of
+    precompute_results and returns the per-employee results with non-negative
+    overtime. If `trace` is a list, the per-day breakdown of every employee is
+    appended to it. If `timings` is a dict, the "calculate" stage duration is added to it.
+    """
+    engine = engine or app.config["CALC_ENGINE"]
+    with timed_stage(timings, "calculate"):
+        if engine == "vectorized":
+            processed_all = apply_monthly_hours_vectorized(precomputed, monthly_hours, trace)
+        elif engine == "python":
+            processed_all = [apply_monthly_hours(employee, monthly_hours, trace) for employee in precomputed]
+        else:
+            raise ValueError(f"Unknown calculation engine '{engine}', expected one of {CALC_ENGINES}")
+    # Only include records with non-negative overtime
+    return [processed for processed in processed_all if processed["overtime"] >= 0]
+
+def calculate_results(rosters, monthly_hours, engine=None, trace=None, timings=None, month=None):
+    """
+    Runs the selected calculation engine (defaults to CALC_ENGINE) over all
+    EmployeeRosters and returns the per-employee results with non-negative overtime.
+    If `trace` is a list, the per-day breakdown of every employee is appended to it.
+    If `timings` is a dict, the "group", "precompute" and "calculate" stage durations are added to it.
+    `month` is passed on to precompute_results.
+    """
+    precomputed = precompute_results(rosters, engine, timings, month)
+    return calculate_precomputed(precomputed, monthly_hours, engine, trace, timings)
+
+# Result columns: (result key, header, column width). "Вкупно работни часови" comes after the name column.
+RESULT_COLUMNS = [
+    ("code", "Шифра", 12),
+    ("name", "Име и Презиме", 24),
+    ("total_hours", "Вкупно работни часови", 18),  # Total Working Hours after the name
+    ("first shift", "Прва смена", 12),
+    ("second+third shift", "Втора и Трета смена заедно", 24),
+    ("third shift", "Трета смена", 12),
+    ("hours per dezurstvo", "Ноќна работа дежурство по час", 28),
+    ("holidays", "Дежурство на празник", 18),
+    ("dezurstva", "Дежурство", 12),
+    ("sunday work", "Работа во Недела", 18),
+    ("overtime sunday work", "Прекувремена работа во недела", 22),
+    ("overtime", "Прекувремена работа", 18),
+]
+
+# Columns of the optional per-day breakdown sheet: (trace record key, header).
+TRACE_COLUMNS = [
+    ("code", "Шифра"),
+    ("name", "Име и Презиме"),
+    ("date", "Датум"),
+    ("day", "Ден"),
+    ("weekday", "Ден во неделата"),
+    ("holiday", "Празник"),
+    ("shift", "Смена"),
+    ("hours", "Часови"),
+    ("counts", "Се брои во работни часови"),
+    ("overtime", "Прекувремена работа"),
+    ("first shift", "Прва смена"),
+    ("second+third shift", "Втора и Трета смена заедно"),
+    ("third shift", "Трета смена"),
+    ("hours per dezurstvo", "Ноќна работа дежурство по час"),
+    ("holidays", "Дежурство на празник"),
+    ("dezurstva", "Дежурство"),
+    ("sunday work", "Работа во Недела"),
+    ("overtime sunday work", "Прекувремена работа во недела"),
+]
+
+OUTPUT_FORMATS = ("xlsx", "csv", "parquet")
+
+# The results of a job as JSON, kept next to the result file for /jobs/<id>/results.
+RESULTS_JSON_FILENAME = "results.json"
+
+def result_filename(output_format):
+    return f"result.{output_format}"
+
+def result_row(r):
+    return [r[key] for key, _, _ in RESULT_COLUMNS]
+
+def write_results_json(results, output_path):
+    """
+    Writes the results as {"columns": [result key, ...], "rows": [[value, ...], ...]},
+    with missing values (NaN) as null.
+    """
+    rows = [[None if pd.isna(value) else value for value in result_row(r)] for r in results]
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({"columns": [key for key, _, _ in RESULT_COLUMNS], "rows": rows}, f, ensure_ascii=False)
+
+@lru_cache(maxsize=16)
+def _read_results_json(path, mtime_ns):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    columns = data["columns"]
+    return tuple(dict(zip(columns, row)) for row in data["rows"])
+
+def read_results_json(path):
+    """
+    The results written by write_results_json, as result dicts. Recently read
+    files are kept in memory (keyed by path and modification time), so paging
+    through a job's results doesn't parse the file on every request.
+    """
+    return _read_results_json(path, os.stat(path).st_mtime_ns)
+
+def query_results(results, search=None, sort=None, descending=False, page=1, per_page=50):
+    """
+    (number of matching results, the results on `page`): results whose code or
+    name contains `search` (case-insensitive), ordered by the result key `sort`
+    (missing values last) or kept in file order.
+    """
+    if search:
+        needle = search.casefold()
+        results = [
+            r for r in results
+            if needle in str(r["code"] or "").casefold() or needle in str(r["name"] or "").casefold()
         ]
-        ws.append(row)
+    if sort:
+        present = [r for r in results if r[sort] is not None]
+        missing = [r for r in results if r[sort] is None]
+        results = sorted(present, key=itemgetter(sort), reverse=descending) + missing
+    start = (page - 1) * per_page
+    return len(results), results[start:start + per_page]
+
+def write_result_sheet(wb, title, results):
+    """Adds a sheet with the result header and one row per result to a write-only workbook."""
+    ws = wb.create_sheet(title)
+    # Write-only sheets need their column widths before the first row
+    for i, (_, _, width) in enumerate(RESULT_COLUMNS, start=1):
+        ws.column_dimensions[openpyxl.utils.get_column_letter(i)].width = width
+    ws.append([header for _, header, _ in RESULT_COLUMNS])
+    for r in results:
+        ws.append(result_row(r))
+
+def generate_result_xlsx(results, output_path, trace=None):
+    """
+    Streams the results into a write-only workbook: rows are written as `results`
+    yields them and no cell objects are kept in memory. When a per-day `trace` is
+    given, a second sheet "Детали" gets one row per employee per day.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    write_result_sheet(wb, "Резултати", results)
+    if trace is not None:
+        details = wb.create_sheet("Детали")
+        details.append([header for _, header in TRACE_COLUMNS])
+        for day_record in trace:
+            details.append([day_record[key] for key, _ in TRACE_COLUMNS])
+    wb.save(output_path)
+
+def sheet_title(name, used):
+    """
+    `name` made into a valid Excel sheet title (at most 31 characters, none of
+    []:*?/\\) that is not in `used`, which it is added to (case-insensitively).
+    """
+    title = re.sub(r"[\[\]:*?/\\]", "_", name).strip("'")[:31] or "Sheet"
+    candidate = title
+    n = 2
+    while candidate.lower() in used:
+        suffix = f" ({n})"
+        candidate = title[:31 - len(suffix)] + suffix
+        n += 1
+    used.add(candidate.lower())
+    return candidate
+
+def yearly_totals(months):
+    """
+    Sums the results of several months per employee (code, name), in order of first
+    appearance. `months` is a list of (title, results).
+    """
+    totals = {}
+    for _, results in months:
+        for r in results:
+            total = totals.get((r["code"], r["name"]))
+            if total is None:
+                totals[(r["code"], r["name"])] = dict(r)
+                continue
+            for key, _, _ in RESULT_COLUMNS:
+                if key not in ("code", "name"):
+                    total[key] += r[key]
+    return list(totals.values())
+
+def generate_batch_xlsx(months, output_path):
+    """
+    Writes one results sheet per month, titled after its file, followed by the
+    per-employee totals of all months. `months` is a list of (title, results).
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    used = {BATCH_TOTALS_SHEET.lower()}
+    for title, results in months:
+        write_result_sheet(wb, sheet_title(title, used), results)
+    write_result_sheet(wb, BATCH_TOTALS_SHEET, yearly_totals(months))
     wb.save(output_path)
 
+def generate_result_csv(results, output_path):
+    """Writes the results as CSV for payroll import, UTF-8 with a BOM so Excel reads the Cyrillic."""
+    with open(output_path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([header for _, header, _ in RESULT_COLUMNS])
+        writer.writerows(result_row(r) for r in results)
+
+def generate_result_parquet(results, output_path):
+    """Writes the results as a Parquet file (needs pyarrow or fastparquet installed)."""
+    df = pd.DataFrame(
+        (result_row(r) for r in results),
+        columns=[header for _, header, _ in RESULT_COLUMNS]
+    )
+    df.to_parquet(output_path, index=False)
+
+def parquet_available():
+    return any(importlib.util.find_spec(engine) for engine in ("pyarrow", "fastparquet"))
+
+def write_results(results, output_path, output_format="xlsx", trace=None):
+    """Writes the results in `output_format`; the per-day trace is only supported for XLSX."""
+    if output_format == "xlsx":
+        generate_result_xlsx(results, output_path, trace)
+    elif output_format == "csv":
+        generate_result_csv(results, output_path)
+    elif output_format == "parquet":
+        generate_result_parquet(results, output_path)
+    else:
+        raise ValueError(f"Unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}")
+
+# ---------- Upload Cache ----------
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Hit/miss counters of this web process, fed by the cache events jobs report back.
+CACHE_STATS = {
+    "parsed": {"hits": 0, "misses": 0},
+    "precomputed": {"hits": 0, "misses": 0},
+    "result": {"hits": 0, "misses": 0},
+}
+_cache_stats_lock = threading.Lock()
+
+class FileTooLargeError(ValueError):
+    """Raised by save_stream when a stream is longer than its limit."""
+
+class UploadExpiredError(Exception):
+    """Raised when an upload known only by its hash is no longer in the cache."""
+
+def save_stream(stream, file_path, limit=None):
+    """
+    Copies a binary stream to `file_path` in chunks and returns the SHA-256 hex
+    digest of its bytes. Raises FileTooLargeError past `limit` bytes, leaving a
+    partial file behind.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, "wb") as out:
+        for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""):
+            size += len(chunk)
+            if limit is not None and size > limit:
+                raise FileTooLargeError(f"{os.path.basename(file_path)} is larger than {limit} bytes.")
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+def save_upload(file, file_path):
+    """Streams the upload to `file_path` and returns the SHA-256 hex digest of its bytes."""
+    return save_stream(file.stream, file_path)
+
+def hash_file(file_path):
+    """SHA-256 hex digest of a file on disk."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_enabled():
+    return app.config["CACHE_MAX_BYTES"] > 0
+
+def cache_dir():
+    """
+    CACHE_DIR, created private (0700) on first use. Cached records are unpickled,
+    so anyone able to write to the directory could run code as this app: returns
+    None, which bypasses the cache, unless it is a real directory owned by this
+    user that nobody else can write to.
+    """
+    path = app.config["CACHE_DIR"]
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        info = os.lstat(path)
+    except OSError as e:
+        app.logger.error(f"Cache disabled, {path} is not usable: {e}")
+        return None
+    owner_ok = not hasattr(os, "getuid") or info.st_uid == os.getuid()
+    if not stat.S_ISDIR(info.st_mode) or not owner_ok or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        app.logger.error(f"Cache disabled, {path} must be a directory owned by this user and writable only by it.")
+        return None
+    return path
+
+def cache_lookup(name):
+    """Path of the cache entry `name`, marking it as recently used, or None on a miss."""
+    if not cache_enabled():
+        return None
+    directory = cache_dir()
+    if directory is None:
+        return None
+    path = os.path.join(directory, name)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+def cache_store(name, write):
+    """
+    Adds the cache entry `name` by calling write(path) on a temporary path that is
+    then renamed into place, and evicts least recently used entries while the
+    cache is over CACHE_MAX_BYTES.
+    """
+    if not cache_enabled():
+        return
+    directory = cache_dir()
+    if directory is None:
+        return
+    tmp_path = os.path.join(directory, f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, os.path.join(directory, name))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    evict_cache()
+
+def cache_usage():
+    """[(last used, size, path), ...] for every entry in CACHE_DIR."""
+    entries = []
+    try:
+        scanned = list(os.scandir(app.config["CACHE_DIR"]))
+    except FileNotFoundError:
+        return entries
+    for entry in scanned:
+        if entry.name.endswith(".tmp"):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+def evict_cache():
+    entries = cache_usage()
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= app.config["CACHE_MAX_BYTES"]:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def record_cache_events(events):
+    """Counts the {"parsed"/"precomputed"/"result": "hit"/"miss"} events a job reported."""
+    global _metrics_dirty
+    _metrics_dirty = True
+    with _cache_stats_lock:
+        for kind, event in events.items():
+            CACHE_STATS[kind]["hits" if event == "hit" else "misses"] += 1
+
+# Part of the names of pickled cache entries; bumped when what they hold changes shape.
+CACHE_FORMAT = 2
+
+def rosters_cache_name(file_hash, engine):
+    """Cache entry name of the parsed rosters of this upload and ingest engine."""
+    return f"rosters-v{CACHE_FORMAT}-{file_hash}-{engine or app.config['INGEST_ENGINE']}.pkl"
+
+def calendar_cache_key(month):
+    """Identifies the calendar a job uses in cache names: inferred, or a month with HOLIDAYS."""
+    if month is None:
+        return "auto"
+    return f"{month[0]:04d}{month[1]:02d}-{HOLIDAYS_FINGERPRINT}"
+
+def load_rosters(file_path, file_hash, engine, cache_events, counts=None):
+    """
+    read_and_combine_all_sheets, cached per file hash and ingest engine. Returns
+    (employee count, rosters) and records "hit"/"miss" in cache_events["parsed"].
+    If `counts` is a dict, the sheet and employee counts and the number of days
+    ("daily_records") are stored in it. `file_path` is None when the upload is
+    only known by its hash; UploadExpiredError is raised if it isn't cached.
+    """
+    counts = {} if counts is None else counts
+    engine = engine or app.config["INGEST_ENGINE"]
+    name = rosters_cache_name(file_hash, engine) if file_hash else None
+    path = cache_lookup(name) if name else None
+    if path:
+        try:
+            with open(path, "rb") as f:
+                employee_count, counts["sheets"], all_rosters = pickle.load(f)
+            cache_events["parsed"] = "hit"
+            counts["employees"] = employee_count
+            counts["daily_records"] = sum(len(roster) for roster in all_rosters)
+            return employee_count, all_rosters
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            app.logger.warning(f"Ignoring unreadable cache entry {path}")
+    if file_path is None:
+        raise UploadExpiredError("This upload is no longer available, please upload the file again.")
+    all_employees, all_rosters = read_and_combine_all_sheets(file_path, engine, counts=counts)
+    counts["employees"] = len(all_employees)
+    counts["daily_records"] = sum(len(roster) for roster in all_rosters)
+    if name and cache_enabled():
+        cache_events["parsed"] = "miss"
+
+        def write(tmp_path):
+            with open(tmp_path, "wb") as f:
+                pickle.dump((len(all_employees), counts["sheets"], all_rosters), f, protocol=pickle.HIGHEST_PROTOCOL)
+        cache_store(name, write)
+    return len(all_employees), all_rosters
+
+def precomputed_cache_name(file_hash, ingest_engine, calc_engine, month=None):
+    """Cache entry name of the precompute_results output for this upload, engines and calendar."""
+    ingest_engine = ingest_engine or app.config["INGEST_ENGINE"]
+    calc_engine = calc_engine or app.config["CALC_ENGINE"]
+    return (
+        f"precomputed-v{CACHE_FORMAT}-{file_hash}-{ingest_engine}-{calc_engine}"
+        f"-{calendar_cache_key(month)}-{SHIFT_CODES_FINGERPRINT}.pkl"
+    )
+
+def load_precomputed(file_path, file_hash, ingest_engine, calc_engine, cache_events, counts=None, timings=None, month=None):
+    """
+    precompute_results over load_rosters, cached per file hash, engines, calendar
+    and shift code registry, so recalculating an upload for another monthly_hours only
+    runs the overtime pass. Returns (employee count, precomputed) and records
+    "hit"/"miss" in cache_events["precomputed"]. `counts` is filled like
+    load_rosters does; if `timings` is a dict, the "read" stage (loading the
+    cache entry or the rosters) and the precompute stages are added to it.
+    """
+    counts = {} if counts is None else counts
+    name = precomputed_cache_name(file_hash, ingest_engine, calc_engine, month) if file_hash else None
+    path = cache_lookup(name) if name else None
+    if path:
+        try:
+            with timed_stage(timings, "read"):
+                with open(path, "rb") as f:
+                    cached_counts, precomputed = pickle.load(f)
+            cache_events["precomputed"] = "hit"
+            counts.update(cached_counts)
+            return counts["employees"], precomputed
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            app.logger.warning(f"Ignoring unreadable cache entry {path}")
+    with timed_stage(timings, "read"):
+        employee_count, all_rosters = load_rosters(file_path, file_hash, ingest_engine, cache_events, counts)
+    precomputed = precompute_results(all_rosters, calc_engine, timings, month)
+    if name and cache_enabled():
+        cache_events["precomputed"] = "miss"
+        cached_counts = {key: counts[key] for key in ("sheets", "employees", "daily_records")}
+
+        def write(tmp_path):
+            with open(tmp_path, "wb") as f:
+                pickle.dump((cached_counts, precomputed), f, protocol=pickle.HIGHEST_PROTOCOL)
+        cache_store(name, write)
+    return employee_count, precomputed
+
+def upload_available(file_hash, ingest_engine, calc_engine, month=None):
+    """Whether the upload with this hash can be recalculated from the cache without the file."""
+    return bool(
+        cache_lookup(precomputed_cache_name(file_hash, ingest_engine, calc_engine, month))
+        or cache_lookup(rosters_cache_name(file_hash, ingest_engine))
+    )
+
+def result_cache_name(file_hash, monthly_hours, ingest_engine, calc_engine, output_format, month=None):
+    """Cache entry name of the result file for this upload, monthly_hours, engines, calendar and output format."""
+    ingest_engine = ingest_engine or app.config["INGEST_ENGINE"]
+    calc_engine = calc_engine or app.config["CALC_ENGINE"]
+    return (
+        f"result-{file_hash}-{monthly_hours!r}-{ingest_engine}-{calc_engine}-{calendar_cache_key(month)}"
+        f"-{SHIFT_CODES_FINGERPRINT}.{output_format}"
+    )
+
+# ---------- Metrics ----------
+
+# Stages of a job, in order: saving the upload and handing it to the job pool (web
+# process), waiting in the job queue, parsing (or loading cached records), grouping
+# by employee, the part of the calculation that doesn't depend on monthly_hours,
+# the overtime pass and writing the result file. "cache" is copying a cached result.
+STAGES = ("save", "enqueue", "queue", "read", "group", "precompute", "calculate", "write", "cache")
+# Number of recent samples each summary keeps for its quantiles.
+METRICS_WINDOW = 1024
+METRICS_QUANTILES = (0.5, 0.9, 0.99)
+# Per-job counts reported by run_job, exported as counters.
+JOB_COUNTS = ("sheets", "employees", "daily_records", "results")
+
+METRIC_HELP = {
+    "tato_stage_duration_seconds": ("summary", "Wall time of each processing stage."),
+    "tato_upload_bytes": ("summary", "Size of uploaded files."),
+    "tato_job_peak_rss_bytes": ("summary", "Peak resident memory of the worker process during a job."),
+    "tato_jobs_total": ("counter", "Finished jobs by status."),
+    "tato_sheets_total": ("counter", "Sheets read from uploads."),
+    "tato_employees_total": ("counter", "Employees read from uploads."),
+    "tato_daily_records_total": ("counter", "Employee days read from uploads."),
+    "tato_results_total": ("counter", "Employee rows written to result files."),
+    "tato_cache_lookups_total": ("counter", "Upload cache lookups by cache and outcome."),
+    "tato_jobs_pending": ("gauge", "Jobs queued or running in the web processes."),
+    "tato_janitor_removed_total": ("counter", "Expired job directories removed by the janitor."),
+    "tato_job_dirs": ("gauge", "Job directories on disk."),
+    "tato_job_dir_bytes": ("gauge", "Bytes used by job directories."),
+    "tato_cache_bytes": ("gauge", "Bytes used by the upload cache."),
+    "tato_disk_free_bytes": ("gauge", "Free space on the file system holding JOB_DIR."),
+}
+
+_metrics_lock = threading.Lock()
+# (metric, labels) -> {"samples": recent values, "count": n, "sum": total}
+_summaries = {}
+# (metric, labels) -> total
+_counters = {}
+# Whether the metrics of this process changed since publish_metrics last wrote them.
+_metrics_dirty = False
+METRICS_DIRNAME = "metrics"
+
+@contextmanager
+def timed_stage(timings, stage):
+    """
+    Adds the wall time of the block to timings[stage] in seconds; does nothing if
+    `timings` is None. Raises ValueError for a stage not in STAGES.
+    """
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage '{stage}'.")
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+def reset_peak_rss():
+    """Resets the peak RSS of this process so the next reading covers one job (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_bytes():
+    """Peak resident memory of this process in bytes, or None if the platform can't tell."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # Bytes on macOS, kilobytes elsewhere; never reset, so this is the peak over the
+    # process lifetime.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+def observe(metric, value, **labels):
+    """Adds a sample to a summary metric."""
+    global _metrics_dirty
+    key = (metric, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _metrics_dirty = True
+        summary = _summaries.get(key)
+        if summary is None:
+            summary = _summaries[key] = {"samples": deque(maxlen=METRICS_WINDOW), "count": 0, "sum": 0.0}
+        summary["samples"].append(value)
+        summary["count"] += 1
+        summary["sum"] += value
+
+def increment(metric, amount=1, **labels):
+    """Adds `amount` to a counter metric."""
+    global _metrics_dirty
+    key = (metric, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _metrics_dirty = True
+        _counters[key] = _counters.get(key, 0) + amount
+
+def record_job_metrics(outcome):
+    """Aggregates the summary run_job returns: stage timings, counts, peak RSS and final status."""
+    for stage, seconds in outcome.get("timings", {}).items():
+        observe("tato_stage_duration_seconds", seconds, stage=stage)
+    # Batch jobs time reading and calculating per month.
+    for month in outcome.get("months", ()):
+        for stage, seconds in month["timings"].items():
+            observe("tato_stage_duration_seconds", seconds, stage=stage)
+    for name, value in outcome.get("counts", {}).items():
+        if name in JOB_COUNTS:
+            increment(f"tato_{name}_total", value)
+    if outcome.get("peak_rss_bytes") is not None:
+        observe("tato_job_peak_rss_bytes", outcome["peak_rss_bytes"])
+    increment("tato_jobs_total", status=outcome.get("status", "failed"))
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+def metrics_snapshot():
+    """The counters, summaries, cache stats and pending jobs of this process, as JSON-serializable data."""
+    global _metrics_dirty
+    with _metrics_lock:
+        _metrics_dirty = False
+        summaries = [
+            [name, labels, list(s["samples"]), s["count"], s["sum"]] for (name, labels), s in _summaries.items()
+        ]
+        counters = [[name, labels, value] for (name, labels), value in _counters.items()]
+    with _cache_stats_lock:
+        cache = {kind: dict(counts) for kind, counts in CACHE_STATS.items()}
+    with _job_executor_lock:
+        pending = len(_pending_jobs)
+    return {"pid": os.getpid(), "summaries": summaries, "counters": counters, "cache": cache, "pending": pending}
+
+def metrics_dir():
+    return os.path.join(app.config["JOB_DIR"], METRICS_DIRNAME)
+
+def publish_metrics(force=False):
+    """
+    With METRICS_SHARED, writes metrics_snapshot() to <JOB_DIR>/metrics/<pid>.json
+    if anything changed since the last call (or `force`), for the other web
+    processes to add up.
+    """
+    if not app.config["METRICS_SHARED"] or not (_metrics_dirty or force):
+        return
+    directory = metrics_dir()
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(metrics_snapshot(), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        app.logger.error(f"Could not publish metrics to {path}: {e}")
+
+def clear_shared_metrics():
+    """Removes the published metrics of earlier processes, e.g. when the server starts."""
+    shutil.rmtree(metrics_dir(), ignore_errors=True)
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def collect_metrics():
+    """
+    (summaries, counters, cache stats, pending jobs) of this process, or with
+    METRICS_SHARED added up over every web process that published its metrics.
+    Counters of processes that exited still count; their pending jobs don't.
+    """
+    snapshots = [metrics_snapshot()]
+    if app.config["METRICS_SHARED"]:
+        publish_metrics(force=True)
+        try:
+            names = [name for name in os.listdir(metrics_dir()) if name.endswith(".json")]
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if name == f"{os.getpid()}.json":
+                continue
+            try:
+                with open(os.path.join(metrics_dir(), name), encoding="utf-8") as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not process_alive(snapshot["pid"]):
+                snapshot["pending"] = 0
+            snapshots.append(snapshot)
+
+    summaries = {}
+    counters = {}
+    cache = {kind: {"hits": 0, "misses": 0} for kind in CACHE_STATS}
+    pending = 0
+    for snapshot in snapshots:
+        for name, labels, samples, count, total in snapshot["summaries"]:
+            merged = summaries.setdefault((name, tuple(map(tuple, labels))), [[], 0, 0.0])
+            merged[0].extend(samples)
+            merged[1] += count
+            merged[2] += total
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for kind, counts in snapshot["cache"].items():
+            for outcome, value in counts.items():
+                cache.setdefault(kind, {"hits": 0, "misses": 0})[outcome] += value
+        pending += snapshot["pending"]
+    return summaries, counters, cache, pending
+
+def render_metrics():
+    """The metrics of the web processes (see collect_metrics) in the Prometheus text format."""
+    merged, counters, cache, pending = collect_metrics()
+    summaries = {key: (sorted(samples), count, total) for key, (samples, count, total) in merged.items()}
+    for kind, counts in cache.items():
+        counters[("tato_cache_lookups_total", (("cache", kind), ("result", "hit")))] = counts["hits"]
+        counters[("tato_cache_lookups_total", (("cache", kind), ("result", "miss")))] = counts["misses"]
+    gauges = {("tato_jobs_pending", ()): pending}
+    job_dirs, job_dir_bytes = job_dir_usage()
+    gauges[("tato_job_dirs", ())] = job_dirs
+    gauges[("tato_job_dir_bytes", ())] = job_dir_bytes
+    gauges[("tato_cache_bytes", ())] = sum(size for _, size, _ in cache_usage())
+    gauges[("tato_disk_free_bytes", ())] = shutil.disk_usage(job_root()).free
+
+    lines = []
+    for metric, (kind, help_text) in METRIC_HELP.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        if kind == "summary":
+            for (name, labels), (samples, count, total) in sorted(summaries.items()):
+                if name != metric:
+                    continue
+                for q in METRICS_QUANTILES:
+                    value = samples[min(int(q * len(samples)), len(samples) - 1)]
+                    lines.append(f"{metric}{format_labels(labels + (('quantile', q),))} {value}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {total}")
+                lines.append(f"{metric}_count{format_labels(labels)} {count}")
+        else:
+            values = counters if kind == "counter" else gauges
+            for (name, labels), value in sorted(values.items()):
+                if name == metric:
+                    lines.append(f"{metric}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+def server_timing_header(timings):
+    """Server-Timing header value for stage timings given in seconds, in STAGES order."""
+    ordered = sorted(timings.items(), key=lambda item: STAGES.index(item[0]) if item[0] in STAGES else len(STAGES))
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in ordered)
+
+# ---------- Upload Storage ----------
+
+# Queued or running jobs are only expired once their status is this old, in case
+# the process running them died without marking them failed.
+STALE_JOB_SECONDS = 24 * 3600
+
+_janitor_thread = None
+_janitor_lock = threading.Lock()
+
+class SpoolingRequest(Request):
+    """
+    Request whose uploaded files stay in memory up to UPLOAD_SPOOL_BYTES and
+    spool to JOB_DIR beyond that, instead of the system temp directory.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=app.config["UPLOAD_SPOOL_BYTES"], dir=job_root())
+
+app.request_class = SpoolingRequest
+
+def job_root():
+    """JOB_DIR, created on first use."""
+    os.makedirs(app.config["JOB_DIR"], exist_ok=True)
+    return app.config["JOB_DIR"]
+
+def create_job_dir():
+    """A new, empty job directory under JOB_DIR; its name is the job ID."""
+    return tempfile.mkdtemp(prefix="upload_", dir=job_root())
+
+# Uploaded files are kept in this subdirectory of their job directory, so no
+# client file name can collide with the job's status, results or result file.
+JOB_INPUT_DIRNAME = "input"
+
+def job_input_dir(job_dir):
+    """<job_dir>/input, created on first use."""
+    path = os.path.join(job_dir, JOB_INPUT_DIRNAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def upload_filename(filename):
+    """
+    A safe name to store an upload under: the client's file name passed through
+    secure_filename, keeping the extension even when the rest of the name (e.g.
+    Cyrillic) is dropped.
+    """
+    stem, extension = os.path.splitext(filename)
+    if not re.fullmatch(r"\.[A-Za-z0-9]{1,10}", extension):
+        extension = ""
+    return (secure_filename(stem) or "upload") + extension.lower()
+
+def dir_size(path):
+    """Total size in bytes of the files under `path`."""
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(dir_path, file_name))
+            except OSError:
+                pass
+    return total
+
+def job_dir_usage():
+    """(number of job directories, bytes they use) under JOB_DIR."""
+    count = 0
+    total = 0
+    for entry in os.scandir(job_root()):
+        if entry.is_dir() and JOB_ID_PATTERN.match(entry.name):
+            count += 1
+            total += dir_size(entry.path)
+    return count, total
+
+def sweep_job_dirs(now=None):
+    """
+    Removes the job directories nobody collected: finished or failed jobs whose
+    status is older than RESULT_TTL, directories without a status (abandoned
+    uploads) older than that, and queued or running jobs not updated for
+    STALE_JOB_SECONDS. Returns the number of directories removed.
+    """
+    now = now or time.time()
+    removed = 0
+    for entry in os.scandir(job_root()):
+        if not entry.is_dir() or not JOB_ID_PATTERN.match(entry.name):
+            continue
+        status = read_job_status(entry.path)
+        if status is None:
+            expired = now - entry.stat().st_mtime > app.config["RESULT_TTL"]
+        elif status["status"] in ("done", "failed"):
+            expired = now - status["updated"] > app.config["RESULT_TTL"]
+        else:
+            expired = now - status["updated"] > STALE_JOB_SECONDS
+        if expired:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
+
+def _janitor_loop():
+    while True:
+        try:
+            removed = sweep_job_dirs()
+            if removed:
+                increment("tato_janitor_removed_total", removed)
+                publish_metrics()
+                app.logger.info(f"Janitor removed {removed} expired job folder(s).")
+        except Exception as e:
+            app.logger.error(f"Janitor sweep failed: {e}")
+        time.sleep(app.config["JANITOR_INTERVAL"])
+
+def start_janitor():
+    """Starts the janitor thread of this process unless it runs already or JANITOR_INTERVAL is 0."""
+    global _janitor_thread
+    if _janitor_thread is not None or app.config["JANITOR_INTERVAL"] <= 0:
+        return
+    with _janitor_lock:
+        if _janitor_thread is None:
+            _janitor_thread = threading.Thread(target=_janitor_loop, name="tato-janitor", daemon=True)
+            _janitor_thread.start()
+
+# ---------- STEP 5: Background Jobs ----------
+
+JOB_STATUS_FILENAME = "status.json"
+JOB_ID_PATTERN = re.compile(r"^upload_[a-z0-9_]+$")
+# Uploads are identified by the SHA-256 of their bytes.
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+_job_executor = None
+_job_executor_lock = threading.Lock()
+_pending_jobs = set()
+
+class QueueFullError(Exception):
+    """Raised when JOB_QUEUE_DEPTH jobs are already queued or running in this process."""
+
+def get_job_dir(job_id):
+    """Absolute job directory for `job_id`, or None if the ID is malformed or unknown."""
+    if not JOB_ID_PATTERN.match(job_id):
+        return None
+    job_dir = os.path.join(app.config["JOB_DIR"], job_id)
+    return job_dir if os.path.isdir(job_dir) else None
+
+def write_job_status(job_dir, status, **fields):
+    """
+    Atomically records the job state in <job_dir>/status.json. The file is the
+    only shared state, so any web worker can answer status requests for any job.
+    """
+    tmp_path = os.path.join(job_dir, f"{JOB_STATUS_FILENAME}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"status": status, "updated": time.time(), **fields}, f)
+    os.replace(tmp_path, os.path.join(job_dir, JOB_STATUS_FILENAME))
+
+def read_job_status(job_dir):
+    try:
+        with open(os.path.join(job_dir, JOB_STATUS_FILENAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def run_job(job_dir, file_path, monthly_hours, options):
+    """
+    Runs in a pool worker: parses the upload, calculates the results and writes
+    the result file into `job_dir`, recording progress in its status file.
+    Parsed records, precomputed results and result workbooks are reused from the
+    cache when the same file (options["file_hash"]) was processed before;
+    `file_path` is None when recalculating a cached upload. Returns the final status,
+    cache events, stage timings, counts and peak RSS for the web process to
+    aggregate; the timings and counts are also kept in the status file.
+    """
+    reset_peak_rss()
+    outcome = {"cache": {}, "timings": {}, "counts": {}}
+    if options.get("submitted"):
+        outcome["timings"]["queue"] = max(time.time() - options["submitted"], 0.0)
+    write_job_status(job_dir, "running")
+    try:
+        error = process_upload(job_dir, file_path, monthly_hours, options, outcome)
+    except Exception as e:
+        job_logger(job_dir).error(f"Error during processing: {e}")
+        error = f"An error occurred during processing: {e}"
+    finally:
+        if file_path:
+            os.remove(file_path)
+    outcome["status"] = "failed" if error else "done"
+    outcome["peak_rss_bytes"] = peak_rss_bytes()
+    fields = {"timings": outcome["timings"], "counts": outcome["counts"]}
+    if error:
+        write_job_status(job_dir, "failed", error=error, **fields)
+    else:
+        # The ID /recompute accepts, while the upload stays in the cache.
+        if options.get("file_hash") and cache_enabled():
+            fields["upload_id"] = options["file_hash"]
+        if options.get("month"):
+            fields["month"] = "{:04d}-{:02d}".format(*options["month"])
+        write_job_status(job_dir, "done", filename=result_filename(options.get("output_format", "xlsx")), **fields)
+    return outcome
+
+def process_upload(job_dir, file_path, monthly_hours, options, outcome):
+    """
+    The stages of run_job, each timed into outcome["timings"]. Returns an error
+    message, or None once the result file is written.
+    """
+    cache_events, timings, counts = outcome["cache"], outcome["timings"], outcome["counts"]
+    file_hash = options.get("file_hash")
+    ingest_engine = options.get("ingest_engine")
+    calc_engine = options.get("calc_engine")
+    month = options.get("month")
+    output_format = options.get("output_format", "xlsx")
+    result_path = os.path.join(job_dir, result_filename(output_format))
+
+    results_json_path = os.path.join(job_dir, RESULTS_JSON_FILENAME)
+
+    # Trace runs always recalculate, their workbook has the extra details sheet.
+    result_name = results_json_name = None
+    if file_hash and not options.get("trace") and cache_enabled():
+        result_name = result_cache_name(file_hash, monthly_hours, ingest_engine, calc_engine, output_format, month)
+        results_json_name = result_cache_name(file_hash, monthly_hours, ingest_engine, calc_engine, "json", month)
+        cached_result = cache_lookup(result_name)
+        cached_results_json = cache_lookup(results_json_name)
+        if cached_result and cached_results_json:
+            with timed_stage(timings, "cache"):
+                shutil.copyfile(cached_result, result_path)
+                shutil.copyfile(cached_results_json, results_json_path)
+            cache_events["result"] = "hit"
+            return None
+        cache_events["result"] = "miss"
+
+    employee_count, precomputed = load_precomputed(
+        file_path, file_hash, ingest_engine, calc_engine, cache_events, counts, timings, month
+    )
+    if not employee_count:
+        return "No valid employee data found in any sheet."
+
+    trace = [] if options.get("trace") else None
+    results = calculate_precomputed(precomputed, monthly_hours, calc_engine, trace, timings)
+    counts["results"] = len(results)
+
+    with timed_stage(timings, "write"):
+        write_results(results, result_path, output_format, trace)
+        write_results_json(results, results_json_path)
+    job_logger(job_dir).info(f"Result generated at {result_path}")
+    if result_name:
+        cache_store(result_name, partial(shutil.copyfile, result_path))
+        cache_store(results_json_name, partial(shutil.copyfile, results_json_path))
+    return None
+
+def get_job_executor():
+    """The process pool jobs run in, created on first use with JOB_WORKERS processes."""
+    global _job_executor
+    with _job_executor_lock:
+        if _job_executor is None:
+            start_method = app.config["JOB_START_METHOD"]
+            max_tasks = app.config["JOB_MAX_TASKS"]
+            _job_executor = ProcessPoolExecutor(
+                max_workers=app.config["JOB_WORKERS"],
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=load_processing_stack,
+                max_tasks_per_child=max_tasks if max_tasks > 0 and start_method != "fork" else None
+            )
+        return _job_executor
+
+def load_processing_stack():
+    """Imports pandas, numpy and openpyxl now rather than in the middle of the first job."""
+    for name in PROCESSING_MODULES:
+        importlib.import_module(name)
+
+def warm_job_pool():
+    """
+    Starts the JOB_WORKERS job pool processes ahead of the first upload (each loads
+    the processing stack as it starts), e.g. right after a gunicorn worker boots.
+    """
+    executor = get_job_executor()
+    for _ in range(app.config["JOB_WORKERS"]):
+        executor.submit(load_processing_stack)
+
+def _job_finished(job_dir, future):
+    global _job_executor, _metrics_dirty
+    with _job_executor_lock:
+        _pending_jobs.discard(future)
+        _metrics_dirty = True
+    try:
+        outcome = future.result()
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool for the next job.
+        with _job_executor_lock:
+            _job_executor = None
+        increment("tato_jobs_total", status="failed")
+        write_job_status(job_dir, "failed", error="The worker processing this file stopped unexpectedly.")
+        return
+    except CancelledError:
+        increment("tato_jobs_total", status="failed")
+        write_job_status(job_dir, "failed", error="The server restarted before this file was processed, please upload it again.")
+        return
+    except Exception as e:
+        increment("tato_jobs_total", status="failed")
+        write_job_status(job_dir, "failed", error=f"An error occurred during processing: {e}")
+        return
+    record_cache_events(outcome["cache"])
+    for month in outcome.get("months", ()):
+        record_cache_events(month["cache"])
+    record_job_metrics(outcome)
+
+def shutdown_jobs():
+    """
+    Cancels the queued jobs of this process (marking them failed) and waits for
+    the running ones, e.g. before a gunicorn worker exits on a restart.
+    """
+    global _job_executor
+    with _job_executor_lock:
+        executor, _job_executor = _job_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def reset_after_fork():
+    """
+    Forgets the pools, janitor thread, locks and metrics a forked process
+    inherited from its parent (e.g. a gunicorn worker forked from a preloaded
+    master), so it starts its own on first use.
+    """
+    global _job_executor, _job_executor_lock, _pending_jobs, _parse_executor, _parse_executor_lock
+    global _janitor_thread, _janitor_lock, _metrics_lock, _summaries, _counters, _metrics_dirty, _cache_stats_lock
+    _job_executor = None
+    _job_executor_lock = threading.Lock()
+    _pending_jobs = set()
+    _parse_executor = None
+    _parse_executor_lock = threading.Lock()
+    _janitor_thread = None
+    _janitor_lock = threading.Lock()
+    _metrics_lock = threading.Lock()
+    _summaries = {}
+    _counters = {}
+    _metrics_dirty = False
+    _cache_stats_lock = threading.Lock()
+    for counts in CACHE_STATS.values():
+        counts.update(hits=0, misses=0)
+
+def submit_job(job_dir, job, *args):
+    """
+    Queues job(job_dir, *args) (run_job or run_batch_job) on the pool. Raises
+    QueueFullError when JOB_QUEUE_DEPTH jobs are already queued or running in
+    this web process.
+    """
+    global _job_executor, _metrics_dirty
+    executor = get_job_executor()
+    with _job_executor_lock:
+        if len(_pending_jobs) >= app.config["JOB_QUEUE_DEPTH"]:
+            raise QueueFullError()
+        write_job_status(job_dir, "queued")
+        try:
+            future = executor.submit(job, job_dir, *args)
+        except BrokenProcessPool:
+            _job_executor = None
+            raise
+        _pending_jobs.add(future)
+        _metrics_dirty = True
+    future.add_done_callback(partial(_job_finished, job_dir))
+    # Jobs finish outside of any request, so their metrics are published right away.
+    future.add_done_callback(lambda _: publish_metrics())
+    return future
+
+# ---------- Batch Processing ----------
+
+BATCH_RESULT_FILENAME = "batch_result.xlsx"
+BATCH_MANIFEST_NAME = "manifest.json"
+BATCH_TOTALS_SHEET = "Вкупно"
+BATCH_EXTENSIONS = (".xlsx",) + tuple(DELIMITED_EXTENSIONS)
+
+# One file of a batch: its sheet title in the combined workbook, where it is on
+# disk, the month's working hours and the SHA-256 of the file (for the cache).
+BatchMonth = namedtuple("BatchMonth", ["title", "file_path", "monthly_hours", "file_hash"])
+
+def parse_manifest(text):
+    """
+    Parses a batch manifest: a JSON object mapping file names to the month's
+    working hours, e.g. {"01.xlsx": 176, "02.xlsx": 160}. Raises ValueError if it isn't one.
+    """
+    manifest = json.loads(text)
+    if not isinstance(manifest, dict):
+        raise ValueError("The manifest must be a JSON object mapping file names to monthly hours.")
+    try:
+        return {os.path.basename(name): float(hours) for name, hours in manifest.items()}
+    except (TypeError, ValueError):
+        raise ValueError("The monthly hours in the manifest must be numbers.")
+
+def batch_months(paths, manifest=None, monthly_hours=None, hashes=None):
+    """
+    Pairs roster files with their monthly hours: from `manifest` by file name,
+    otherwise `monthly_hours`. Files are ordered as in the manifest, then by name.
+    Raises ValueError for files without hours and manifest entries without a file.
+    """
+    manifest = manifest or {}
+    by_name = {os.path.basename(path): path for path in paths}
+    if len(by_name) < len(paths):
+        raise ValueError("Every file in a batch needs a different name.")
+    missing = [name for name in manifest if name not in by_name]
+    if missing:
+        raise ValueError(f"Files listed in the manifest were not found: {', '.join(missing)}")
+    names = list(manifest) + sorted(name for name in by_name if name not in manifest)
+    unpriced = [name for name in names if name not in manifest and monthly_hours is None]
+    if unpriced:
+        raise ValueError(f"No monthly hours given for: {', '.join(unpriced)}")
+    hashes = hashes or {}
+    return [
+        BatchMonth(
+            os.path.splitext(name)[0],
+            by_name[name],
+            manifest.get(name, monthly_hours),
+            hashes.get(name) or hash_file(by_name[name])
+        )
+        for name in names
+    ]
+
+def extract_batch_zip(zip_path, target_dir, manifest=None, monthly_hours=None):
+    """
+    Extracts the .xlsx/.csv/.tsv files of a batch ZIP into `target_dir` (flattened,
+    hidden files and folders skipped) and returns their BatchMonths. Hours come
+    from `manifest`, else from a manifest.json in the archive, else `monthly_hours`.
+    Raises FileTooLargeError once more than BATCH_MAX_EXTRACTED_BYTES are unpacked.
+    """
+    paths = []
+    hashes = {}
+    budget = app.config["BATCH_MAX_EXTRACTED_BYTES"]
+    with zipfile.ZipFile(zip_path) as archive:
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or name.startswith(".") or info.filename.startswith("__MACOSX/"):
+                continue
+            if name == BATCH_MANIFEST_NAME:
+                if manifest is None:
+                    manifest = parse_manifest(archive.read(info).decode("utf-8-sig"))
+                continue
+            if os.path.splitext(name)[1].lower() not in BATCH_EXTENSIONS:
+                continue
+            if name in hashes:
+                raise ValueError(f"The archive contains more than one file named {name}.")
+            path = os.path.join(target_dir, name)
+            with archive.open(info) as member:
+                try:
+                    hashes[name] = save_stream(member, path, budget)
+                except FileTooLargeError:
+                    raise FileTooLargeError("The archive unpacks to more than BATCH_MAX_EXTRACTED_BYTES.")
+            budget -= os.path.getsize(path)
+            paths.append(path)
+    if not paths:
+        raise ValueError("The archive contains no .xlsx, .csv or .tsv files.")
+    return batch_months(paths, manifest, monthly_hours, hashes)
+
+def calculate_month(month, options):
+    """
+    Runs in a batch pool worker: parses one BatchMonth (through the parsed records
+    and precomputed results caches) and calculates its results. Returns its
+    title, results, cache events, counts and stage timings.
+    """
+    summary = {"title": month.title, "cache": {}, "counts": {}, "timings": {}}
+    employee_count, precomputed = load_precomputed(
+        month.file_path, month.file_hash, options.get("ingest_engine"), options.get("calc_engine"),
+        summary["cache"], summary["counts"], summary["timings"]
+    )
+    if not employee_count:
+        raise ValueError(f"No valid employee data found in any sheet of {month.title}.")
+    summary["results"] = calculate_precomputed(
+        precomputed, month.monthly_hours, options.get("calc_engine"), timings=summary["timings"]
+    )
+    summary["counts"]["results"] = len(summary["results"])
+    return summary
+
+def parse_sequentially():
+    """Batch pool initializer: the files are already calculated in parallel, so each worker parses its sheets in order."""
+    app.config["PARSE_WORKERS"] = 1
+
+def calculate_months(months, options, workers=None):
+    """
+    Runs calculate_month for every BatchMonth, in a process pool when `workers`
+    (or BATCH_WORKERS) is greater than 1. Summaries are returned in month order.
+    """
+    workers = min(workers or app.config["BATCH_WORKERS"], len(months))
+    if workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(app.config["JOB_START_METHOD"]),
+            initializer=parse_sequentially
+        ) as executor:
+            return list(executor.map(calculate_month, months, repeat(options)))
+    return [calculate_month(month, options) for month in months]
+
+def run_batch_job(job_dir, months, options):
+    """
+    Runs in a job pool worker: calculates every month of a batch and writes the
+    combined workbook (one sheet per month plus totals) into `job_dir`. Returns
+    a summary like run_job, with the per-month summaries under "months".
+    """
+    reset_peak_rss()
+    outcome = {"cache": {}, "timings": {}, "counts": {}, "months": []}
+    if options.get("submitted"):
+        outcome["timings"]["queue"] = max(time.time() - options["submitted"], 0.0)
+    write_job_status(job_dir, "running")
+    error = None
+    try:
+        summaries = calculate_months(months, options)
+        with timed_stage(outcome["timings"], "write"):
+            generate_batch_xlsx(
+                [(summary["title"], summary["results"]) for summary in summaries],
+                os.path.join(job_dir, BATCH_RESULT_FILENAME)
+            )
+        for summary in summaries:
+            del summary["results"]
+            for name, value in summary["counts"].items():
+                outcome["counts"][name] = outcome["counts"].get(name, 0) + value
+        outcome["months"] = summaries
+    except Exception as e:
+        job_logger(job_dir).error(f"Error during batch processing: {e}")
+        error = f"An error occurred during processing: {e}"
+    finally:
+        for month in months:
+            os.remove(month.file_path)
+    outcome["status"] = "failed" if error else "done"
+    outcome["peak_rss_bytes"] = peak_rss_bytes()
+    fields = {
+        "timings": outcome["timings"],
+        "counts": outcome["counts"],
+        "months": [{"title": summary["title"], "counts": summary["counts"]} for summary in outcome["months"]],
+    }
+    if error:
+        write_job_status(job_dir, "failed", error=error, **fields)
+    else:
+        write_job_status(job_dir, "done", filename=BATCH_RESULT_FILENAME, **fields)
+    return outcome
+
 # ---------- STEP 6: Flask Routes ----------
 
+# Page sizes of /jobs/<id>/results.
+RESULTS_PER_PAGE = 50
+RESULTS_MAX_PER_PAGE = 500
+RESULT_KEYS = tuple(key for key, _, _ in RESULT_COLUMNS)
+
+# Request IDs taken from the X-Request-ID header (set by e.g. the Heroku router).
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+@app.before_request
+def ensure_janitor():
+    start_janitor()
+
+@app.before_request
+def bind_request_logger():
+    """g.log: the logger of this request, tagged with its X-Request-ID or a new ID."""
+    request_id = request.headers.get("X-Request-ID", "")
+    if not REQUEST_ID_PATTERN.match(request_id):
+        request_id = uuid.uuid4().hex[:12]
+    g.request_id = request_id
+    g.log = RequestLogger(app.logger, {"request_id": request_id})
+
+@app.after_request
+def publish_request_metrics(response):
+    publish_metrics()
+    return response
+
+@app.after_request
+def add_request_id(response):
+    if "request_id" in g:
+        response.headers["X-Request-ID"] = g.request_id
+    return response
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    limit_mb = app.config["MAX_CONTENT_LENGTH"] / (1024 * 1024)
+    return error_response(f"The file is too large, the limit is {limit_mb:g} MB.", 413)
+
 @app.route("/")
 def index():
-    return render_template("index.html")
+    return render_template("index.html", parquet_available=parquet_available())
+
+def wants_json():
+    return request.accept_mimetypes.best == "application/json"
+
+def error_response(message, status=400):
+    """{"error": message} with `status` for clients asking for JSON; browsers go back to the form with a flash."""
+    if wants_json():
+        return jsonify(error=message), status
+    flash(message)
+    return redirect(url_for("index"))
+
+def read_job_options(form):
+    """
+    (monthly_hours, options) from the fields of a /process or /recompute form.
+    Raises ValueError with the message to show when a field is invalid.
+    """
+    try:
+        monthly_hours = float(form.get("monthly_hours", "").strip())
+    except ValueError:
+        raise ValueError("You must input just numbers for the Total Monthly Hours.")
+    calc_engine = form.get("calc_engine", "").strip() or None
+    if calc_engine is not None and calc_engine not in CALC_ENGINES:
+        raise ValueError(f"Unknown calculation engine '{calc_engine}'.")
+    output_format = form.get("output_format", "").strip() or "xlsx"
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}'.")
+    trace = bool(form.get("trace"))
+    if trace and output_format != "xlsx":
+        raise ValueError("The per-day breakdown is only available for Excel (.xlsx) output.")
+    month_input = form.get("month", "").strip()
+    month = parse_month(month_input) if month_input else None
+    return monthly_hours, {"calc_engine": calc_engine, "trace": trace, "output_format": output_format, "month": month}
+
+def busy_response():
+    message = "The server is busy processing other files, please try again in a minute."
+    if wants_json():
+        return jsonify(error=message), 503, {"Retry-After": "30"}
+    flash(message)
+    return redirect(url_for("index"))
+
+def queued_response(temp_dir, filename, timings, **fields):
+    """
+    The answer to a queued job: 202 with the job ID and URLs (plus `fields`) for
+    clients asking for JSON, the page polling the job status for browsers.
+    """
+    job_id = os.path.basename(temp_dir)
+    g.log.info(f"Queued job {job_id}")
+    headers = {"Server-Timing": server_timing_header(timings)} if app.config["SERVER_TIMING"] else {}
+    if wants_json():
+        return jsonify(
+            job_id=job_id,
+            **fields,
+            status_url=url_for("job_status", job_id=job_id),
+            download_url=url_for("download_file", temp_dir=job_id, filename=filename)
+        ), 202, headers
+    return render_template(
+        "download.html", job_id=job_id, temp_dir=job_id, filename=filename,
+        output_format=os.path.splitext(filename)[1][1:]
+    ), headers
 
 @app.route("/process", methods=["POST"])
 def process_file():
-    monthly_hours_input = request.form.get("monthly_hours", "").strip()
+    """
+    Saves the upload and queues it for processing. Browsers get a page that polls
+    the job status; clients asking for JSON get 202 with the job ID and URLs.
+    """
     try:
-        monthly_hours = float(monthly_hours_input)
-    except ValueError:
-        flash("You must input just numbers for the Total Monthly Hours.")
-        return redirect(url_for("index"))
+        monthly_hours, options = read_job_options(request.form)
+    except ValueError as e:
+        return error_response(str(e))
     
     if "file" not in request.files:
-        flash("No file part in the request.")
-        return redirect(url_for("index"))
+        return error_response("No file part in the request.")
     file = request.files["file"]
     if file.filename == "":
-        flash("No file selected.")
-        return redirect(url_for("index"))
+        return error_response("No file selected.")
+
+    timings = {}
+    temp_dir = create_job_dir()
+    try:
+        file_path = os.path.join(job_input_dir(temp_dir), upload_filename(file.filename))
+        with timed_stage(timings, "save"):
+            options["file_hash"] = save_upload(file, file_path)
+        g.log.info(f"File saved to {file_path}")
+        observe("tato_stage_duration_seconds", timings["save"], stage="save")
+        observe("tato_upload_bytes", os.path.getsize(file_path))
+        options["submitted"] = time.time()
+        with timed_stage(timings, "enqueue"):
+            submit_job(temp_dir, run_job, file_path, monthly_hours, options)
+    except QueueFullError:
+        shutil.rmtree(temp_dir)
+        return busy_response()
+    except Exception as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        g.log.error(f"Error during processing: {e}")
+        return error_response(f"An error occurred during processing: {e}", 500)
 
+    upload_id = options["file_hash"] if cache_enabled() else None
+    return queued_response(temp_dir, result_filename(options["output_format"]), timings, upload_id=upload_id)
+
+@app.route("/recompute", methods=["POST"])
+def recompute():
+    """
+    Recalculates an earlier upload for a new monthly_hours (and output options)
+    without uploading or parsing it again: `upload_id` is the ID /process and
+    finished jobs report. Only the overtime pass runs while the upload's
+    precomputed results are cached. Responds like /process, or 404 once the
+    upload has left the cache.
+    """
     try:
-        temp_dir = tempfile.mkdtemp(prefix="upload_")
-        file_path = os.path.join(temp_dir, file.filename)
-        file.save(file_path)
-        app.logger.info(f"File saved to {file_path}")
-
-        # Read all sheets and combine them
-        all_employees, all_daily_records = read_and_combine_all_sheets(file_path)
-
-        if not all_employees:
-            flash("No valid employee data found in any sheet.")
-            shutil.rmtree(temp_dir)
-            return redirect(url_for("index"))
-
-        # Group daily records by employee
-        emp_dict = {}
-        for rec in all_daily_records:
-            key = (rec["code"], rec["name"])
-            emp_dict.setdefault(key, []).append(rec)
-
-        results = []
-        for key, entries in emp_dict.items():
-            processed = process_employee_entries(entries, monthly_hours)
-            # Only include records with non-negative overtime
-            if processed["overtime"] >= 0:
-                results.append(processed)
-
-        result_xlsx_path = os.path.join(temp_dir, "result.xlsx")
-        generate_result_xlsx(results, result_xlsx_path)
-        app.logger.info(f"Result XLSX generated at {result_xlsx_path}")
-
-        temp_folder_name = os.path.basename(temp_dir)
-        return render_template("download.html", temp_dir=temp_folder_name, filename="result.xlsx")
+        monthly_hours, options = read_job_options(request.form)
+    except ValueError as e:
+        return error_response(str(e))
+    upload_id = request.form.get("upload_id", "").strip()
+    if not UPLOAD_ID_PATTERN.match(upload_id) or not upload_available(
+        upload_id, None, options["calc_engine"], options["month"]
+    ):
+        return error_response("This upload is no longer available, please upload the file again.", 404)
+    options["file_hash"] = upload_id
+
+    timings = {}
+    temp_dir = create_job_dir()
+    try:
+        options["submitted"] = time.time()
+        with timed_stage(timings, "enqueue"):
+            submit_job(temp_dir, run_job, None, monthly_hours, options)
+    except QueueFullError:
+        shutil.rmtree(temp_dir)
+        return busy_response()
+    except Exception as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        g.log.error(f"Error during processing: {e}")
+        return error_response(f"An error occurred during processing: {e}", 500)
+
+    return queued_response(temp_dir, result_filename(options["output_format"]), timings, upload_id=upload_id)
+
+@app.route("/batch", methods=["POST"])
+def process_batch():
+    """
+    Queues a ZIP of monthly roster files as one batch job producing a combined
+    workbook. Monthly hours come from the `manifest` field or a manifest.json in
+    the archive (see parse_manifest); `monthly_hours`, if given, applies to the
+    files not listed. Responds like /process.
+    """
+    monthly_hours_input = request.form.get("monthly_hours", "").strip()
+    monthly_hours = None
+    if monthly_hours_input:
+        try:
+            monthly_hours = float(monthly_hours_input)
+        except ValueError:
+            return error_response("You must input just numbers for the Total Monthly Hours.")
+    manifest = None
+    manifest_input = request.form.get("manifest", "").strip()
+    if manifest_input:
+        try:
+            manifest = parse_manifest(manifest_input)
+        except ValueError as e:
+            return error_response(f"Invalid manifest: {e}")
+    calc_engine = request.form.get("calc_engine", "").strip() or None
+    if calc_engine is not None and calc_engine not in CALC_ENGINES:
+        return error_response(f"Unknown calculation engine '{calc_engine}'.")
+    options = {"calc_engine": calc_engine}
 
+    file = request.files.get("file")
+    if file is None or file.filename == "":
+        return error_response("No file selected.")
+
+    timings = {}
+    temp_dir = create_job_dir()
+    try:
+        # The members are unpacked next to the archive, away from batch_result.xlsx.
+        input_dir = job_input_dir(temp_dir)
+        zip_path = os.path.join(input_dir, "batch.zip")
+        with timed_stage(timings, "save"):
+            save_upload(file, zip_path)
+            observe("tato_upload_bytes", os.path.getsize(zip_path))
+            try:
+                months = extract_batch_zip(zip_path, input_dir, manifest, monthly_hours)
+            finally:
+                os.remove(zip_path)
+        observe("tato_stage_duration_seconds", timings["save"], stage="save")
+        options["submitted"] = time.time()
+        with timed_stage(timings, "enqueue"):
+            submit_job(temp_dir, run_batch_job, months, options)
+    except (ValueError, zipfile.BadZipFile) as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return error_response(f"Invalid batch archive: {e}")
+    except QueueFullError:
+        shutil.rmtree(temp_dir)
+        return busy_response()
     except Exception as e:
-        app.logger.error(f"Error during processing: {e}")
-        flash(f"An error occurred during processing: {e}")
-        return redirect(url_for("index"))
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        g.log.error(f"Error during batch processing: {e}")
+        return error_response(f"An error occurred during processing: {e}", 500)
+
+    return queued_response(temp_dir, BATCH_RESULT_FILENAME, timings, months=[month.title for month in months])
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job_dir = get_job_dir(job_id)
+    status = read_job_status(job_dir) if job_dir else None
+    if status is None:
+        return jsonify(error="Unknown job."), 404
+    status["job_id"] = job_id
+    if status["status"] == "done":
+        status["download_url"] = url_for("download_file", temp_dir=job_id, filename=status["filename"])
+        if os.path.exists(os.path.join(job_dir, RESULTS_JSON_FILENAME)):
+            status["results_url"] = url_for("job_results", job_id=job_id)
+    headers = {}
+    if app.config["SERVER_TIMING"] and status.get("timings"):
+        headers["Server-Timing"] = server_timing_header(status["timings"])
+    return jsonify(status), headers
+
+@app.route("/jobs/<job_id>/results")
+def job_results(job_id):
+    """
+    One page of a finished job's results as JSON, read from the results the job
+    stored rather than from the result file. Query parameters: `q` filters by
+    code or name, `sort` is a result key (e.g. "overtime") with `order` "asc" or
+    "desc", `page` starts at 1 and `per_page` is at most RESULTS_MAX_PER_PAGE.
+    """
+    job_dir = get_job_dir(job_id)
+    status = read_job_status(job_dir) if job_dir else None
+    if status is None:
+        return jsonify(error="Unknown job."), 404
+    if status["status"] != "done":
+        return jsonify(error="The result is not ready yet.", status=status["status"]), 409
+    path = os.path.join(job_dir, RESULTS_JSON_FILENAME)
+    if not os.path.exists(path):
+        return jsonify(error="This job has no results to preview."), 404
+
+    search = request.args.get("q", "").strip()
+    sort = request.args.get("sort", "").strip() or None
+    if sort is not None and sort not in RESULT_KEYS:
+        return jsonify(error=f"Unknown sort column '{sort}', expected one of {list(RESULT_KEYS)}."), 400
+    order = request.args.get("order", "desc" if sort else "asc")
+    if order not in ("asc", "desc"):
+        return jsonify(error="order must be 'asc' or 'desc'."), 400
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", RESULTS_PER_PAGE, type=int)
+    if page < 1 or not 1 <= per_page <= RESULTS_MAX_PER_PAGE:
+        return jsonify(error=f"page must be at least 1 and per_page between 1 and {RESULTS_MAX_PER_PAGE}."), 400
+
+    total, rows = query_results(read_results_json(path), search, sort, order == "desc", page, per_page)
+    return jsonify(
+        job_id=job_id,
+        total=total,
+        page=page,
+        per_page=per_page,
+        pages=max((total + per_page - 1) // per_page, 1),
+        sort=sort,
+        order=order,
+        columns=[{"key": key, "header": header} for key, header, _ in RESULT_COLUMNS],
+        results=list(rows),
+    )
+
+@app.route("/metrics")
+def metrics():
+    """Stage timings, counts, memory and cache metrics of the web processes for Prometheus."""
+    return render_metrics(), {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route("/cache/stats")
+def cache_stats():
+    """Cache hit/miss counters of the web processes and the current cache size."""
+    entries = cache_usage()
+    _, _, stats, _ = collect_metrics()
+    stats["entries"] = len(entries)
+    stats["bytes"] = sum(size for _, size, _ in entries)
+    stats["max_bytes"] = app.config["CACHE_MAX_BYTES"]
+    return jsonify(stats)
 
 @app.route("/download/<temp_dir>/<filename>")
 def download_file(temp_dir, filename):
-    base_temp = tempfile.gettempdir()
-    temp_path = os.path.join(base_temp, temp_dir)
+    temp_path = get_job_dir(temp_dir)
+    status = read_job_status(temp_path) if temp_path else None
+    if status is None or filename != status.get("filename"):
+        abort(404)
+    if status["status"] != "done":
+        return jsonify(error="The result is not ready yet.", status=status["status"]), 409
     file_path = os.path.join(temp_path, filename)
     try:
         return send_file(file_path, as_attachment=True)
     finally:
         try:
             shutil.rmtree(temp_path)
-            app.logger.info(f"Temporary folder {temp_path} deleted.")
+            g.log.info(f"Temporary folder {temp_path} deleted.")
         except Exception as e:
-            app.logger.error(f"Error deleting temporary folder {temp_path}: {e}")
+            g.log.error(f"Error deleting temporary folder {temp_path}: {e}")
 
 if __name__ == "__main__":
     app.run(debug=True)
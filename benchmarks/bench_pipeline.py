@@ -0,0 +1,138 @@
+"""
+Benchmarks each stage of the roster pipeline on a synthetic workbook and reports
+wall time (median and best of --repeat runs) and peak traced memory per stage.
+
+Usage:
+    python benchmarks/bench_pipeline.py --employees 500 --sheets 4 --repeat 3
+    python benchmarks/bench_pipeline.py --json bench.json   # keep results for comparison
+
+Peak memory is measured with tracemalloc in a separate run of each stage, so it
+does not slow down the timed runs.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from synthetic_roster import write_synthetic_workbook  # noqa: E402
+
+MONTHLY_HOURS = 160.0
+
+def measure(fn, repeat):
+    """Runs fn `repeat` times for timing plus once under tracemalloc. Returns (result, times, peak bytes)."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, times, peak
+
+def run_stages(workbook_path, output_dir, repeat):
+    """Yields (stage name, times, peak bytes, items processed) for every pipeline stage."""
+    def stream_rows():
+        return [(name, list(rows)) for name, rows in app.iter_workbook_rows(workbook_path)]
+
+    frames, times, peak = measure(lambda: app.read_all_sheets(workbook_path), repeat)
+    yield "read_all_sheets (pandas)", times, peak, None
+
+    def extract_frames():
+        return [app.extract_frame_employee_rows(df) for df in frames.values()]
+    frame_employees, times, peak = measure(extract_frames, repeat)
+    yield "extract_frame_employee_rows", times, peak, sum(len(employees) for employees in frame_employees)
+
+    sheets, times, peak = measure(stream_rows, repeat)
+    yield "iter_workbook_rows", times, peak, sum(len(rows) for _, rows in sheets)
+
+    def extract():
+        return [app.extract_employee_rows(rows) for _, rows in sheets]
+    employees_per_sheet, times, peak = measure(extract, repeat)
+    yield "extract_employee_rows", times, peak, sum(len(employees) for employees in employees_per_sheet)
+
+    def parse_days():
+        rosters = []
+        for (_, rows), employees in zip(sheets, employees_per_sheet):
+            rosters.extend(app.parse_days_into_rosters(rows[:6], employees))
+        return rosters
+    rosters, times, peak = measure(parse_days, repeat)
+    day_count = sum(len(roster) for roster in rosters)
+    yield "parse_days_into_rosters", times, peak, day_count
+
+    _, times, peak = measure(lambda: app.read_and_combine_all_sheets(workbook_path, "openpyxl", 1), repeat)
+    yield "read_and_combine_all_sheets", times, peak, day_count
+
+    results, times, peak = measure(lambda: app.calculate_results(rosters, MONTHLY_HOURS, "python"), repeat)
+    yield "process_employee_entries", times, peak, day_count
+
+    _, times, peak = measure(lambda: app.calculate_results(rosters, MONTHLY_HOURS, "vectorized"), repeat)
+    yield "process_all_entries_vectorized", times, peak, day_count
+
+    # Recalculating for other monthly hours only repeats the overtime pass.
+    for engine in app.CALC_ENGINES:
+        precomputed = app.precompute_results(rosters, engine)
+        _, times, peak = measure(lambda: app.calculate_precomputed(precomputed, MONTHLY_HOURS, engine), repeat)
+        yield f"calculate_precomputed[{engine}]", times, peak, day_count
+
+    output_path = os.path.join(output_dir, "result.xlsx")
+    _, times, peak = measure(lambda: app.generate_result_xlsx(results, output_path), repeat)
+    yield "generate_result_xlsx", times, peak, len(results)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--employees", type=int, default=500, help="employees per sheet")
+    parser.add_argument("--sheets", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workbook", help="benchmark this workbook instead of generating one")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory(prefix="tato_bench_") as tmp_dir:
+        workbook_path = args.workbook
+        if workbook_path is None:
+            workbook_path = os.path.join(tmp_dir, "roster.xlsx")
+            write_synthetic_workbook(workbook_path, args.employees, args.sheets, seed=args.seed)
+        size = os.path.getsize(workbook_path)
+        print(f"Workbook: {workbook_path} ({size / 1024:.0f} KiB), "
+              f"{args.employees} employees x {args.sheets} sheets, best of {args.repeat}")
+        print(f"{'stage':<34}{'median s':>10}{'best s':>10}{'peak MiB':>10}{'items':>10}")
+        stages = []
+        for name, times, peak, items in run_stages(workbook_path, tmp_dir, args.repeat):
+            stages.append({
+                "stage": name,
+                "median_s": statistics.median(times),
+                "best_s": min(times),
+                "peak_bytes": peak,
+                "items": items,
+            })
+            print(f"{name:<34}{statistics.median(times):>10.3f}{min(times):>10.3f}"
+                  f"{peak / 2**20:>10.1f}{items if items is not None else '':>10}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "employees_per_sheet": args.employees,
+                "sheets": args.sheets,
+                "workbook_bytes": size,
+                "repeat": args.repeat,
+                "stages": stages,
+            }, f, indent=2)
+
+if __name__ == "__main__":
+    main()
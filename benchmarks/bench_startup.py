@@ -0,0 +1,105 @@
+"""
+Benchmarks how long a fresh process takes to import the app and to answer its
+first request, with the processing stack (pandas, numpy, openpyxl) loaded lazily
+as app.py does and, for comparison, imported eagerly up front. Also times
+load_processing_stack, the import every job pool process pays when it starts.
+
+Usage:
+    python benchmarks/bench_startup.py --repeat 5
+    python benchmarks/bench_startup.py --json startup.json   # keep results for comparison
+
+Every run is a new interpreter. "median s" and "best s" are measured inside it
+from just before the imports; "process s" is the median wall time of the whole
+process including interpreter start-up, and "RSS MiB" its peak resident memory.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EAGER_IMPORTS = "import numpy, pandas, openpyxl\n"
+FIRST_REQUEST = """
+response = app.app.test_client().get("/")
+assert response.status_code == 200, response.status_code
+"""
+CASES = (
+    ("import app", "import app\n"),
+    ("import app (eager stack)", EAGER_IMPORTS + "import app\n"),
+    ("import app + GET /", "import app\n" + FIRST_REQUEST),
+    ("import app + GET / (eager stack)", EAGER_IMPORTS + "import app\n" + FIRST_REQUEST),
+    ("import app + load_processing_stack", "import app\napp.load_processing_stack()\n"),
+)
+
+PRELUDE = """
+import json, logging, sys, time
+logging.disable(logging.INFO)
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+"""
+EPILOGUE = """
+seconds = time.perf_counter() - start
+try:
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+except ImportError:  # Windows
+    maxrss = None
+print(json.dumps({{
+    "seconds": seconds,
+    "maxrss_bytes": maxrss,
+    "stack_loaded": all(name in sys.modules for name in {modules!r}),
+}}))
+"""
+
+def run_case(code):
+    """Runs `code` in a new interpreter. Returns (in-process seconds, process seconds, peak RSS bytes, stack loaded)."""
+    script = PRELUDE.format(root=ROOT) + code + EPILOGUE.format(modules=("numpy", "pandas", "openpyxl"))
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True)
+    elapsed = time.perf_counter() - start
+    outcome = json.loads(completed.stdout.strip().splitlines()[-1])
+    return outcome["seconds"], elapsed, outcome["maxrss_bytes"], outcome["stack_loaded"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    print(f"Python {platform.python_version()}, best of {args.repeat} fresh processes")
+    print(f"{'case':<38}{'median s':>10}{'best s':>10}{'process s':>11}{'RSS MiB':>9}{'stack':>7}")
+    cases = []
+    for name, code in CASES:
+        runs = [run_case(code) for _ in range(args.repeat)]
+        times = [run[0] for run in runs]
+        process_times = [run[1] for run in runs]
+        maxrss = max(run[2] or 0 for run in runs)
+        stack_loaded = runs[-1][3]
+        cases.append({
+            "case": name,
+            "median_s": statistics.median(times),
+            "best_s": min(times),
+            "process_median_s": statistics.median(process_times),
+            "maxrss_bytes": maxrss,
+            "stack_loaded": stack_loaded,
+        })
+        print(f"{name:<38}{statistics.median(times):>10.3f}{min(times):>10.3f}"
+              f"{statistics.median(process_times):>11.3f}{maxrss / 2**20:>9.1f}"
+              f"{'yes' if stack_loaded else 'no':>7}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "repeat": args.repeat,
+                "cases": cases,
+            }, f, indent=2)
+
+if __name__ == "__main__":
+    main()
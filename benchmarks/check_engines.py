@@ -0,0 +1,90 @@
+"""
+Checks on synthetic workbooks that the calculation engines and ingest paths
+agree: "python" and "vectorized" must return the same results and per-day
+trace, with and without a roster month and public holidays, and the openpyxl
+and pandas ingest engines must yield rosters that calculate the same.
+
+Usage:
+    python benchmarks/check_engines.py --employees 200 --sheets 3 --seeds 3
+
+Exits with an error naming the first case that differs.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from synthetic_roster import write_synthetic_workbook  # noqa: E402
+
+MONTHLY_HOURS = (0, 100.5, 160, 400)
+# (year, month) of the generated workbooks, cycled through by seed.
+MONTHS = ((2025, 3), (2024, 2), (2025, 12))
+
+def holidays_of(year, month):
+    """A few public holidays in the given month, one of them on a weekend when there is one."""
+    days = [datetime.date(year, month, day) for day in (1, 8, 24)]
+    weekend = next(
+        (datetime.date(year, month, day) for day in range(1, 29) if datetime.date(year, month, day).weekday() >= 5),
+        None
+    )
+    return frozenset(days + ([weekend] if weekend else []))
+
+def compare_engines(rosters, label, month=None):
+    """Fails unless both engines give the same results and trace for every MONTHLY_HOURS."""
+    for monthly_hours in MONTHLY_HOURS:
+        case = f"{label}, monthly_hours={monthly_hours}, month={month}, holidays={len(app.HOLIDAYS)}"
+        traces = {}
+        results = {}
+        for engine in app.CALC_ENGINES:
+            traces[engine] = []
+            results[engine] = app.calculate_results(rosters, monthly_hours, engine, traces[engine], month=month)
+        if results["python"] != results["vectorized"]:
+            sys.exit(f"results differ: {case}")
+        # Trace values may be numpy scalars on one side; compare them as JSON.
+        if json.dumps(traces["python"], default=str) != json.dumps(traces["vectorized"], default=str):
+            sys.exit(f"traces differ: {case}")
+
+def check_workbook(path, year, month):
+    rosters = {}
+    for engine in app.INGEST_ENGINES:
+        _, rosters[engine] = app.read_and_combine_all_sheets(path, engine, workers=1)
+    for monthly_hours in MONTHLY_HOURS:
+        by_ingest = [app.calculate_results(rosters[engine], monthly_hours, "python") for engine in app.INGEST_ENGINES]
+        if any(results != by_ingest[0] for results in by_ingest[1:]):
+            sys.exit(f"ingest engines differ: {path}, monthly_hours={monthly_hours}")
+
+    label = os.path.basename(path)
+    compare_engines(rosters["openpyxl"], label)
+    compare_engines(rosters["openpyxl"], label, (year, month))
+    saved = app.HOLIDAYS
+    app.HOLIDAYS = holidays_of(year, month)
+    try:
+        compare_engines(rosters["openpyxl"], label, (year, month))
+    finally:
+        app.HOLIDAYS = saved
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--employees", type=int, default=200, help="employees per sheet")
+    parser.add_argument("--sheets", type=int, default=3)
+    parser.add_argument("--seeds", type=int, default=3, help="number of workbooks, generated with seeds 0..N-1")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory(prefix="tato_check_") as tmp_dir:
+        for seed in range(args.seeds):
+            year, month = MONTHS[seed % len(MONTHS)]
+            path = os.path.join(tmp_dir, f"roster-{seed}.xlsx")
+            write_synthetic_workbook(path, args.employees, args.sheets, year=year, month=month, seed=seed)
+            check_workbook(path, year, month)
+            print(f"seed {seed} ({year}-{month:02d}): engines agree")
+    print("ok")
+
+if __name__ == "__main__":
+    main()
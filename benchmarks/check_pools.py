@@ -0,0 +1,100 @@
+"""
+Regression run for the process pools: sheets parsed in parallel (PARSE_WORKERS
+> 1) inside job processes that are replaced after every job (JOB_MAX_TASKS=1)
+and inside a parallel batch (BATCH_WORKERS > 1). Every job must finish, cli.py
+must exit and shutdown_jobs must return; a hang fails the run after --timeout
+seconds.
+
+Usage:
+    python benchmarks/check_pools.py --jobs 3 --timeout 120
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+POOL_SETTINGS = {
+    "PARSE_WORKERS": "2",
+    "JOB_WORKERS": "1",
+    "JOB_MAX_TASKS": "1",
+    "BATCH_WORKERS": "2",
+    # Every job parses its upload instead of copying a cached result.
+    "CACHE_MAX_BYTES": "0",
+    "JANITOR_INTERVAL": "0",
+}
+os.environ.update(POOL_SETTINGS)
+
+import app  # noqa: E402
+from synthetic_roster import write_synthetic_workbook  # noqa: E402
+
+def run_jobs(workbook_path, jobs, timeout):
+    """Submits `jobs` uploads through /process one after another and waits for each to finish."""
+    client = app.app.test_client()
+    for i in range(jobs):
+        with open(workbook_path, "rb") as f:
+            response = client.post(
+                "/process", data={"monthly_hours": str(160 + i), "file": (f, "roster.xlsx")},
+                headers={"Accept": "application/json"}
+            )
+        if response.status_code != 202:
+            sys.exit(f"job {i}: /process answered {response.status_code}: {response.get_json()}")
+        status_url = response.get_json()["status_url"]
+        deadline = time.monotonic() + timeout
+        while True:
+            status = client.get(status_url).get_json()
+            if status["status"] == "done":
+                break
+            if status["status"] == "failed":
+                sys.exit(f"job {i} failed: {status.get('error')}")
+            if time.monotonic() > deadline:
+                sys.exit(f"job {i} still {status['status']} after {timeout} s")
+            time.sleep(0.1)
+        print(f"job {i}: done")
+
+def run_cli(paths, output_path, timeout):
+    """Runs a parallel batch through cli.py in a new process."""
+    command = [sys.executable, os.path.join(ROOT, "cli.py")]
+    command += [f"{path}={hours}" for path, hours in zip(paths, (160, 176))]
+    command += ["-o", output_path]
+    try:
+        subprocess.run(command, cwd=ROOT, env={**os.environ, **POOL_SETTINGS},
+                       capture_output=True, check=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        sys.exit(f"cli.py did not exit within {timeout} s")
+    except subprocess.CalledProcessError as e:
+        sys.exit(f"cli.py failed with {e.returncode}: {e.stderr.decode(errors='replace')}")
+    print("cli.py: done")
+
+def run_shutdown(timeout):
+    """Calls shutdown_jobs (gunicorn's worker_exit) and checks that it returns."""
+    thread = threading.Thread(target=app.shutdown_jobs, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        sys.exit(f"shutdown_jobs did not return within {timeout} s")
+    print("shutdown_jobs: done")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=3, help="uploads processed one after another")
+    parser.add_argument("--timeout", type=int, default=120, help="seconds before a step counts as hung")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="tato_pools_") as tmp_dir:
+        app.app.config["JOB_DIR"] = os.path.join(tmp_dir, "jobs")
+        paths = [os.path.join(tmp_dir, f"s{i}.xlsx") for i in range(2)]
+        for seed, path in enumerate(paths):
+            write_synthetic_workbook(path, employees=50, sheets=4, seed=seed)
+        run_jobs(paths[0], args.jobs, args.timeout)
+        run_cli(paths, os.path.join(tmp_dir, "batch.xlsx"), args.timeout)
+        run_shutdown(args.timeout)
+    print("ok")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Synthetic roster workbooks in the layout app.py parses:
+
+  rows 0-3   title rows
+  row 4      day-of-week letters (П В С Ч П С Н) in columns 3..33
+  row 5      day numbers in columns 3..33
+  then per employee a 'смени' row (code, name, 'смени', shift codes...)
+  followed by a 'р.час' row with the hours of each day.
+
+Usage:
+    python benchmarks/synthetic_roster.py roster.xlsx --employees 500 --sheets 4
+"""
+import argparse
+import calendar
+import datetime
+import random
+
+from openpyxl import Workbook
+
+DAY_LETTERS = ["П", "В", "С", "Ч", "П", "С", "Н"]
+
+# (shift code, relative weight, hours worked); None hours means "pick a duty length".
+SHIFT_MIX = [
+    (None, 30, None),
+    ("1", 20, 8),
+    ("1/2", 10, 12),
+    ("2", 8, 8),
+    ("2/3", 6, 16),
+    ("3", 5, 8),
+    ("24", 4, 24),
+    ("1/2/3", 2, 24),
+    ("д", 3, None),
+    ("д16", 3, 16),
+    ("ДПР", 1, None),
+    ("Д24", 1, 24),
+    ("ГО", 4, 8),
+    ("СЛ", 2, 8),
+]
+DUTY_HOURS = [8, 12, 16, 17.5]
+
+def write_synthetic_workbook(path, employees=500, sheets=4, year=2025, month=3, seed=0):
+    """
+    Writes a workbook with `sheets` department sheets of `employees` employees
+    each for the given month. A few '1/2' and '2/3' cells are stored the way
+    Excel misreads them (0.5 and a 3 February date) to exercise convert_shift_value.
+    Returns the number of employees written.
+    """
+    rnd = random.Random(seed)
+    codes = [code for code, _, _ in SHIFT_MIX]
+    weights = [weight for _, weight, _ in SHIFT_MIX]
+    hours_by_code = {code: hours for code, _, hours in SHIFT_MIX}
+    days_in_month = calendar.monthrange(year, month)[1]
+    padding = [None] * (31 - days_in_month)
+    letters = [DAY_LETTERS[datetime.date(year, month, day).weekday()] for day in range(1, days_in_month + 1)]
+
+    wb = Workbook(write_only=True)
+    employee_code = 1000
+    for sheet_index in range(sheets):
+        ws = wb.create_sheet(f"Одделение {sheet_index + 1}")
+        ws.append(["ЈЗУ Болница"])
+        ws.append([])
+        ws.append([f"Распоред за {month:02d}.{year}"])
+        ws.append([])
+        ws.append([None, None, None] + letters + padding + ["Вкупно"])
+        ws.append([None, None, None] + list(range(1, days_in_month + 1)) + padding)
+        for _ in range(employees):
+            employee_code += 1
+            shifts = []
+            hours = []
+            for code in rnd.choices(codes, weights, k=days_in_month):
+                worked = hours_by_code[code]
+                if code is not None and worked is None:
+                    worked = rnd.choice(DUTY_HOURS)
+                if code == "1/2" and rnd.random() < 0.1:
+                    code = 0.5
+                elif code == "2/3" and rnd.random() < 0.1:
+                    code = datetime.datetime(year, 2, 3)
+                shifts.append(code)
+                hours.append(worked)
+            ws.append([employee_code, f"Вработен {employee_code}", "смени"] + shifts + padding + [sum(h for h in hours if h)])
+            ws.append([None, None, "р.час"] + hours + padding)
+    wb.save(path)
+    return employees * sheets
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--employees", type=int, default=500, help="employees per sheet")
+    parser.add_argument("--sheets", type=int, default=4)
+    parser.add_argument("--year", type=int, default=2025)
+    parser.add_argument("--month", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    total = write_synthetic_workbook(args.path, args.employees, args.sheets, args.year, args.month, args.seed)
+    print(f"Wrote {total} employees to {args.path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Batch processing from the command line: calculates several monthly roster
+files (concurrently, see --workers) and writes one workbook with a results
+sheet per month and a sheet with each employee's totals.
+
+    python cli.py 01.xlsx=176 02.xlsx=160 03.csv=184 -o 2025.xlsx
+    python cli.py --manifest manifest.json -o 2025.xlsx
+    python cli.py 2025.zip -o 2025.xlsx
+
+A manifest is the same JSON object /batch accepts, mapping file names (relative
+to the manifest) to monthly hours. A ZIP is read like an upload to /batch.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import app
+
+def parse_file_argument(item):
+    """Splits FILE=HOURS into (FILE, hours); plain FILE gives (FILE, None)."""
+    path, sep, hours = item.rpartition("=")
+    if not sep:
+        return item, None
+    try:
+        return path, float(hours)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid monthly hours in {item!r}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", type=parse_file_argument, metavar="FILE[=HOURS]",
+                        help="monthly roster files (.xlsx/.csv/.tsv) with their monthly hours, or one .zip")
+    parser.add_argument("--manifest", help="JSON file mapping roster file names to monthly hours")
+    parser.add_argument("--monthly-hours", type=float, help="monthly hours for files without their own")
+    parser.add_argument("-o", "--output", default=app.BATCH_RESULT_FILENAME, help="combined result workbook")
+    parser.add_argument("--workers", type=int, default=None,
+                        help=f"files calculated at once (default: BATCH_WORKERS, {app.app.config['BATCH_WORKERS']})")
+    parser.add_argument("--calc-engine", choices=app.CALC_ENGINES, default=None)
+    parser.add_argument("--ingest-engine", choices=app.INGEST_ENGINES, default=None)
+    args = parser.parse_args(argv)
+    options = {"calc_engine": args.calc_engine, "ingest_engine": args.ingest_engine}
+
+    with tempfile.TemporaryDirectory(prefix="tato_batch_") as temp_dir:
+        try:
+            if len(args.files) == 1 and args.files[0][0].lower().endswith(".zip"):
+                months = app.extract_batch_zip(args.files[0][0], temp_dir, None, args.monthly_hours)
+            else:
+                manifest = {}
+                paths = []
+                if args.manifest:
+                    with open(args.manifest, encoding="utf-8-sig") as f:
+                        manifest = app.parse_manifest(f.read())
+                    base_dir = os.path.dirname(os.path.abspath(args.manifest))
+                    paths = [os.path.join(base_dir, name) for name in manifest]
+                # Files given on the command line keep their order.
+                for path, hours in args.files:
+                    paths.append(path)
+                    hours = hours if hours is not None else args.monthly_hours
+                    if hours is not None:
+                        manifest[os.path.basename(path)] = hours
+                if not paths:
+                    parser.error("no roster files given")
+                months = app.batch_months(paths, manifest, args.monthly_hours)
+            summaries = app.calculate_months(months, options, args.workers)
+        except (OSError, ValueError) as e:
+            sys.exit(f"error: {e}")
+
+    app.generate_batch_xlsx([(summary["title"], summary["results"]) for summary in summaries], args.output)
+    for month, summary in zip(months, summaries):
+        counts = summary["counts"]
+        print(f"{month.title}: {month.monthly_hours:g} hours, {counts['employees']} employees, "
+              f"{counts['results']} results")
+    print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Gunicorn settings for running the app with threaded workers:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Each worker process serves WEB_THREADS requests at once, so a slow upload or
+download doesn't hold up other users; the calculations themselves run in the
+job pool of each worker (JOB_WORKERS processes, see app.py). Every setting can
+be overridden through the environment variable named next to it.
+"""
+import os
+
+# Workers add up each other's metrics (files under JOB_DIR/metrics), so a /metrics
+# scrape covers the whole server whichever worker answers it.
+os.environ.setdefault("METRICS_SHARED", "1")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = "gthread"
+# WEB_CONCURRENCY is the conventional knob of PaaS platforms such as Heroku.
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+threads = int(os.environ.get("WEB_THREADS", "8"))
+# Uploads of up to MAX_UPLOAD_BYTES can take a while on slow connections.
+timeout = int(os.environ.get("WEB_TIMEOUT", "120"))
+keepalive = 5
+
+# Workers are not recycled after a number of requests: a stopping worker cancels
+# the jobs still queued in it, and the memory pandas/openpyxl build up is in the
+# job processes, which app.py replaces after JOB_MAX_TASKS jobs. WEB_MAX_REQUESTS
+# turns recycling back on (e.g. to work around a leak in the web process).
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.environ.get("WEB_MAX_REQUESTS_JITTER", "0"))
+# Time a stopping worker (restart, deploy) gets to finish its requests and running jobs.
+graceful_timeout = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", "120"))
+
+# Import the app (Flask and the routes; pandas, numpy and openpyxl are only
+# loaded by the job pool processes) once in the master, so workers are forked
+# with it already loaded.
+preload_app = os.environ.get("WEB_PRELOAD", "1").lower() in ("1", "true", "yes")
+
+# The worker heartbeat file is touched constantly; keep it off slow disks.
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+def on_starting(server):
+    # Counters left by an earlier run of the server would be added to this one's.
+    import app
+    app.clear_shared_metrics()
+
+def post_fork(server, worker):
+    import app
+    app.reset_after_fork()
+    if app.app.config["JOB_PREWARM"]:
+        app.warm_job_pool()
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown_jobs()